@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""End-to-end goodput benchmark over the simulated paper channel.
+
+Each run copies the client and server stacks into a scratch directory, starts
+a simulated channel in each direction, sends a payload from the client Sender
+to the server Receiver and records how many pages and how much simulated
+time the transfer took. Runs sweep the cartesian product of the parameters.
+
+    python bench/goodput.py run --payload-sizes 512,1024 --loss 0,0.1 -o a.json
+    python bench/goodput.py compare a.json b.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# Sweep parameter -> (setting it maps to, whether it applies to Sender, Receiver)
+SETTINGS = {
+    "payload_size": ("PACKET_SIZE", True, True),
+    "ec": ("ERROR_CORRECTION", True, True),
+    "window": ("N", True, True),
+    "timeout": ("TIMEOUT", True, False),
+    "dup_ack_threshold": ("DUP_ACK_THRESHOLD", True, False),
+    "ack_every": ("ACK_EVERY", False, True),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def run_once(config, transfer_bytes, time_scale, time_limit, channel_args, seed):
+    """Run one transfer and return its metrics"""
+    with tempfile.TemporaryDirectory(prefix="paperbench_") as tmp:
+        tmp = Path(tmp)
+        for host in ("client", "server"):
+            shutil.copytree(REPO_ROOT / host / "src", tmp / host / "src", ignore=shutil.ignore_patterns("__pycache__"))
+            (tmp / host / "data" / "transport" / "printing").mkdir(parents=True)
+
+        payload = os.urandom(transfer_bytes)
+        outgoing = tmp / "client" / "data" / "app" / "out"
+        outgoing.mkdir(parents=True)
+        (outgoing / "request_bench.json").write_bytes(payload)
+        delivered_file = tmp / "server" / "data" / "app" / "in" / "request_.json"
+
+        sender_overrides, receiver_overrides = [], []
+        for key, (setting, for_sender, for_receiver) in SETTINGS.items():
+            if config.get(key) is None:
+                continue
+            if for_sender:
+                sender_overrides += ["--set", f"{setting}={config[key]}"]
+            if for_receiver:
+                receiver_overrides += ["--set", f"{setting}={config[key]}"]
+        # The simulated channel takes pages from the printing directories
+        common = ["--time-scale", str(time_scale), "--no-preview", "--set", "PRINT_PORT=0"]
+        channel = channel_args + ["--loss", str(config["loss"]), "--time-scale", str(time_scale)]
+
+        client_port, server_port = free_port(), free_port()
+        stats = {name: tmp / f"{name}.json" for name in ("client_channel", "server_channel", "sender", "receiver")}
+        commands = [
+            # The client camera sees the server's pages and vice versa
+            [tmp / "client" / "src" / "camera" / "sim_camera.py", tmp / "server" / "data" / "transport" / "printing",
+             "--port", client_port, "--stats", stats["client_channel"], "--seed", seed] + channel,
+            [tmp / "server" / "src" / "camera" / "sim_camera.py", tmp / "client" / "data" / "transport" / "printing",
+             "--port", server_port, "--stats", stats["server_channel"], "--seed", seed + 1] + channel,
+            [tmp / "server" / "src" / "transport" / "receiver.py", "--camera-port", server_port,
+             "--stats", stats["receiver"]] + common + receiver_overrides,
+            [tmp / "client" / "src" / "transport" / "sender.py", "--camera-port", client_port,
+             "--stats", stats["sender"]] + common + sender_overrides,
+        ]
+
+        processes = []
+        start = time.time()
+        try:
+            for i, command in enumerate(commands):
+                processes.append(
+                    subprocess.Popen(
+                        [sys.executable] + [str(part) for part in command],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                )
+                if i < 2:
+                    wait_for_port(client_port if i == 0 else server_port)
+
+            # The Sender exits once everything is ACKed, so the run includes
+            # the final ACK pages and any retransmissions of the tail
+            sender_process = processes[-1]
+            while time.time() - start < time_limit and sender_process.poll() is None:
+                time.sleep(0.2)
+            elapsed = time.time() - start
+            completed = sender_process.poll() == 0
+        finally:
+            # Stop the stacks before the channels so both write their statistics
+            for process in reversed(processes):
+                process.send_signal(signal.SIGTERM)
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+        delivered = delivered_file.read_bytes() if delivered_file.exists() else b""
+        sender, receiver = read_json(stats["sender"]), read_json(stats["receiver"])
+        channels = [read_json(stats["client_channel"]), read_json(stats["server_channel"])]
+
+        pages = sum(channel.get("pages_printed", 0) for channel in channels)
+        data_pages_landed = channels[1].get("pages_landed", 0)
+        sim_hours = elapsed * time_scale / 3600
+        goodput_bytes = len(delivered) if delivered == payload[: len(delivered)] else 0
+
+        return {
+            "config": config,
+            "completed": completed and delivered == payload,
+            "bytes_delivered": goodput_bytes,
+            "pages_printed": pages,
+            "data_pages": sender.get("pages_printed", 0),
+            "ack_pages": receiver.get("pages_printed", 0),
+            "retransmissions": sender.get("retransmissions", 0),
+            "fast_retransmits": sender.get("fast_retransmits", 0),
+            "decode_rate": receiver.get("pages_decoded", 0) / data_pages_landed if data_pages_landed else 0.0,
+            "sim_hours": sim_hours,
+            "goodput_bytes_per_page": goodput_bytes / pages if pages else 0.0,
+            "goodput_bytes_per_sim_hour": goodput_bytes / sim_hours if sim_hours else 0.0,
+        }
+
+
+def parse_list(text, kind):
+    return [kind(part) for part in text.split(",")] if text else [None]
+
+
+def run(args):
+    sweep = {
+        "payload_size": parse_list(args.payload_sizes, int),
+        "ec": parse_list(args.ec, str),
+        "window": parse_list(args.windows, int),
+        "timeout": parse_list(args.timeouts, float),
+        "dup_ack_threshold": parse_list(args.dup_ack_thresholds, int),
+        "ack_every": parse_list(args.ack_every, int),
+        "loss": parse_list(args.loss, float),
+    }
+    channel_args = ["--delay", str(args.delay), "--jitter", str(args.jitter), "--dwell", str(args.dwell),
+                    "--bit-error", str(args.bit_error), "--blur", str(args.blur), "--reorder", str(args.reorder)]
+
+    results = []
+    for values in itertools.product(*sweep.values()):
+        config = dict(zip(sweep.keys(), values))
+        config["loss"] = config["loss"] or 0.0
+        for repeat in range(args.repeats):
+            print(f"run {len(results) + 1}: {config}", file=sys.stderr)
+            result = run_once(config, args.transfer_bytes, args.time_scale, args.time_limit, channel_args,
+                              args.seed + repeat)
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        "transfer_bytes": args.transfer_bytes,
+        "time_scale": args.time_scale,
+        "channel": channel_args,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def compare(args):
+    """Print per-configuration differences of run b relative to run a"""
+    reports = [json.loads(Path(path).read_text()) for path in (args.a, args.b)]
+    grouped = []
+    for report in reports:
+        by_config = {}
+        for result in report["results"]:
+            by_config.setdefault(config_key(result["config"]), []).append(result)
+        grouped.append(by_config)
+
+    metrics = ["goodput_bytes_per_page", "goodput_bytes_per_sim_hour", "pages_printed", "retransmissions", "decode_rate"]
+    for key in sorted(set(grouped[0]) & set(grouped[1])):
+        print(key)
+        for metric in metrics:
+            a, b = (sum(r[metric] for r in runs[key]) / len(runs[key]) for runs in grouped)
+            change = f"{100 * (b - a) / a:+.1f}%" if a else "n/a"
+            print(f"  {metric:<28} {a:>14.2f} {b:>14.2f} {change:>9}")
+
+    for key in sorted(set(grouped[0]) ^ set(grouped[1])):
+        print(f"only in one run: {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Goodput benchmark over the simulated paper channel")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run a parameter sweep")
+    run_parser.add_argument("--payload-sizes", help="Comma-separated PACKET_SIZE values")
+    run_parser.add_argument("--ec", help="Comma-separated error-correction levels (L,M,Q,H)")
+    run_parser.add_argument("--windows", help="Comma-separated window sizes N")
+    run_parser.add_argument("--timeouts", help="Comma-separated TIMEOUT values in simulated seconds")
+    run_parser.add_argument("--dup-ack-thresholds", help="Comma-separated DUP_ACK_THRESHOLD values")
+    run_parser.add_argument("--ack-every", help="Comma-separated ACK_EVERY values")
+    run_parser.add_argument("--loss", default="0", help="Comma-separated page loss rates")
+    run_parser.add_argument("--bit-error", type=float, default=0.0, help="Module flip probability")
+    run_parser.add_argument("--blur", type=float, default=0.0, help="Probability a page lands blurred")
+    run_parser.add_argument("--reorder", type=float, default=0.0, help="Probability a page is held back")
+    run_parser.add_argument("--delay", type=float, default=60.0, help="Mean flight time in simulated seconds")
+    run_parser.add_argument("--jitter", type=float, default=30.0, help="Flight time jitter in simulated seconds")
+    run_parser.add_argument("--dwell", type=float, default=5.0, help="Simulated seconds a page stays in view")
+    run_parser.add_argument("--transfer-bytes", type=int, default=8192, help="Bytes to send per run")
+    run_parser.add_argument("--time-scale", type=float, default=60.0, help="Simulated seconds per real second")
+    run_parser.add_argument("--time-limit", type=float, default=300.0, help="Real seconds before a run is abandoned")
+    run_parser.add_argument("--repeats", type=int, default=1, help="Runs per configuration")
+    run_parser.add_argument("--seed", type=int, default=0, help="Channel random seed of the first repeat")
+    run_parser.add_argument("-o", "--output", help="Write the JSON report here instead of stdout")
+
+    compare_parser = commands.add_parser("compare", help="Compare two reports")
+    compare_parser.add_argument("a", help="Baseline report")
+    compare_parser.add_argument("b", help="Report to compare against the baseline")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
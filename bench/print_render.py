@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Render time and decode rate of the printer's two ways of drawing a page.
+
+`resample` is how ImagePrinter used to print every page: the box_size=10 PNG
+from Sender converted to RGB and resized with LANCZOS to the page width.
+`integer` draws the code's module matrix back at a whole number of printer
+dots per module in 1-bit. Every rendered page is then photographed by a
+simulated camera (scaled so the page spans --camera-pixels, blurred, with
+sensor noise) and decoded.
+
+    python bench/print_render.py --pages 50 --camera-pixels 500,700,900
+"""
+import argparse
+import base64
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import qrcode
+from PIL import Image
+
+REPO_ROOT = Path(__file__).parent.parent
+sys.path.append(str(REPO_ROOT / "client" / "src"))
+sys.path.append(str(REPO_ROOT / "client" / "data" / "transport" / "printing"))
+from page_layout import fit_to_page, largest_module, qr_matrix, render_matrix
+from print_backends import PAGE_SIZE
+from transport.settings import EC_LEVELS
+
+
+def render_resample(png, page_size):
+    return fit_to_page(Image.open(png).convert("RGB"), page_size)
+
+
+def render_integer(png, page_size):
+    matrix = qr_matrix(Image.open(png))
+    return render_matrix(matrix, largest_module(matrix, page_size))
+
+
+RENDERERS = {"resample": render_resample, "integer": render_integer}
+
+
+def make_page_png(rng, payload_size, ec):
+    """A packet page as Sender writes it"""
+    qr = qrcode.QRCode(version=None, error_correction=EC_LEVELS[ec], box_size=10, border=4)
+    qr.add_data(base64.b64encode(rng.bytes(payload_size)).decode("ascii"))
+    qr.make(fit=True)
+
+    png = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(png)
+    return png.getvalue()
+
+
+def photograph(page, page_width, camera_pixels, blur, noise, rng):
+    """Grayscale camera view of a printed page that spans camera_pixels"""
+    gray = np.asarray(page.convert("L"))
+    scale = camera_pixels / page_width
+    view = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if blur > 0:
+        view = cv2.GaussianBlur(view, (0, 0), blur)
+    view = view + rng.normal(0, noise, view.shape)
+    view = np.clip(view, 0, 255).astype(np.uint8)
+    return cv2.copyMakeBorder(view, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=255)
+
+
+def make_decoder():
+    """Decoder the Receiver uses, or OpenCV's where libzbar is missing"""
+    try:
+        from pyzbar.pyzbar import decode
+
+        return "pyzbar", lambda view: [code.data for code in decode(view)]
+    except ImportError:
+        detector = cv2.QRCodeDetector()
+
+        def decode_cv2(view):
+            data, _, _ = detector.detectAndDecode(view)
+            return [data.encode("latin-1")] if data else []
+
+        return "cv2", decode_cv2
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    page_size = (int(PAGE_SIZE[0] * args.dpi), int(PAGE_SIZE[1] * args.dpi))
+    decoder_name, decode = make_decoder()
+    pngs = [make_page_png(rng, args.payload_size, args.ec) for _ in range(args.pages)]
+
+    results = {"decoder": decoder_name, "dpi": args.dpi, "renderers": {}}
+    for name, render in RENDERERS.items():
+        times, decoded = [], {pixels: 0 for pixels in args.camera_pixels}
+        camera_rng = np.random.default_rng(args.seed)
+        page_bytes = 0
+        for png in pngs:
+            start = time.perf_counter()
+            page = render(io.BytesIO(png), page_size)
+            times.append(time.perf_counter() - start)
+            page_bytes = len(page.tobytes())
+
+            for pixels in args.camera_pixels:
+                view = photograph(page, page_size[0], pixels, args.blur, args.noise, camera_rng)
+                decoded[pixels] += bool(decode(view))
+
+        results["renderers"][name] = {
+            "render_ms": 1000 * statistics.median(times),
+            "page_mb": page_bytes / 1e6,
+            "decode_rate": {str(pixels): count / args.pages for pixels, count in decoded.items()},
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare resampled and integer-scaled print rendering")
+    parser.add_argument("--pages", type=int, default=30, help="Packet pages to render with each path")
+    parser.add_argument("--payload-size", type=int, default=1024, help="Packet bytes per page")
+    parser.add_argument("--ec", choices=sorted(EC_LEVELS), default="L", help="Error correction level")
+    parser.add_argument("--dpi", type=int, default=300, help="Printer resolution")
+    parser.add_argument("--camera-pixels", type=lambda s: [int(v) for v in s.split(",")], default=[500, 700, 900],
+                        help="Camera pixels across the page width, comma separated")
+    parser.add_argument("--blur", type=float, default=1.0, help="Camera blur sigma in camera pixels")
+    parser.add_argument("--noise", type=float, default=4.0, help="Camera noise standard deviation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"decoder: {results['decoder']}, {args.dpi} dpi, {args.pages} pages")
+    for name, result in results["renderers"].items():
+        rates = ", ".join(f"{pixels}px {rate:.0%}" for pixels, rate in result["decode_rate"].items())
+        print(f"{name:>8}: {result['render_ms']:6.1f} ms/page, {result['page_mb']:5.1f} MB/page, decoded {rates}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,229 @@
+import argparse
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from PIL import Image, ImageWin
-import win32print
-import win32ui
+from PIL import Image
 import os
-import json
+import queue
+import sys
+from multiprocessing.connection import Listener
+from pathlib import Path
+from threading import Thread
+
+sys.path.append(str(Path(__file__).parent))  # Add this folder to Python path
+sys.path.append(str(Path(__file__).parent.parent.parent.parent / 'src'))  # Add src to Python path
+from page_layout import fit_to_page, largest_module, layout_pages, module_pixels, qr_matrix, render_matrix
+from print_backends import BACKENDS, DEFAULT_DPI, default_backend, make_backend
+from print_queue import Page, PrintQueue, page_name
+from processed_log import ProcessedLog
+from transport.print_handoff import AUTHKEY, MAX_PAGE_BYTES, PRINT_PORT, ProtocolError, read_tags, unpack_page
+
+def open_page(page):
+    """Name and image of a page, an image file or a Page handed over in memory"""
+    if isinstance(page, Page):
+        return page.name, page.image
+    return os.path.basename(page), Image.open(page)
 
 class ImagePrinter:
-    def __init__(self, printer_name=None):
-        self.printer_name = printer_name or win32print.GetDefaultPrinter()
+    def __init__(self, printer_name=None, backend=None, min_module_mm=1.0):
+        self.backend = backend or make_backend(printer_name=printer_name)
+        self.printer_name = self.backend.printer_name or self.backend.name
+        self.min_module_mm = min_module_mm
 
-    def print_image(self, image_path):
-        """Print an image file directly"""
+    def print_image(self, page):
+        """Print an image file or a Page directly"""
         try:
-            # Open printer
-            hprinter = win32print.OpenPrinter(self.printer_name)
-            
-            # Create DC for printer
-            hdc = win32ui.CreateDC()
-            hdc.CreatePrinterDC(self.printer_name)
-            
-            # Start print job
-            hdc.StartDoc('Image Print')
-            hdc.StartPage()
-            
             # Load image
-            image = Image.open(image_path)
-            
-            # Convert image to RGB if it's not
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Get printer page size in pixels (assuming 300 DPI)
-            PRINTER_DPI = 300
-            page_width = int(8.5 * PRINTER_DPI)  # 8.5 inches in pixels
-            page_height = int(11 * PRINTER_DPI)   # 11 inches in pixels
-            
-            # Calculate scaling while maintaining aspect ratio
-            image_aspect = image.size[0] / image.size[1]
-            page_aspect = page_width / page_height
-            
-            if image_aspect > page_aspect:
-                # Image is wider relative to its height than the page
-                width = page_width
-                height = int(width / image_aspect)
+            name, image = open_page(page)
+            page_size = self.backend.page_pixels()
+
+            matrix = qr_matrix(image)
+            if matrix is not None:
+                # Draw the modules as whole printer dots, in 1-bit
+                image = render_matrix(matrix, largest_module(matrix, page_size))
             else:
-                # Image is taller relative to its width than the page
-                height = page_height
-                width = int(height * image_aspect)
-            
-            # Resize image
-            image = image.resize((width, height), Image.Resampling.LANCZOS)
+                # Colour codes get scaled to the printer page, keeping their aspect ratio
+                image = fit_to_page(image.convert('RGB'), page_size)
             
-            # Convert image to bitmap and print
-            dib = ImageWin.Dib(image)
-            dib.draw(hdc.GetHandleOutput(), (0, 0, width, height))
+            # Send it as a one-page job
+            self.backend.print_pages([image], name)
             
-            # End print job
-            hdc.EndPage()
-            hdc.EndDoc()
-            
-            # Clean up
-            hdc.DeleteDC()
-            win32print.ClosePrinter(hprinter)
-            
-            print(f"Image {os.path.basename(image_path)} has been sent to printer: {self.printer_name}")
+            print(f"Image {name} has been sent to printer: {self.printer_name}")
             
         except Exception as e:
             print(f"Error printing: {str(e)}")
 
+    def print_batch(self, pages):
+        """Print several images as one job, as many QR codes per page as fit"""
+        try:
+            images = [open_page(page)[1] for page in pages]
+            pages = layout_pages(
+                images, self.backend.page_pixels(), module_pixels(self.min_module_mm, self.backend.dpi)
+            )
+            self.backend.print_pages(pages, f"{len(images)} images")
+
+            print(f"{len(images)} images on {len(pages)} pages have been sent to printer: {self.printer_name}")
+
+        except Exception as e:
+            print(f"Error printing: {str(e)}")
+
 class FileHandler(FileSystemEventHandler):
-    def __init__(self, printer):
+    """Queues the images that appear in the watched folder or arrive over the
+    hand-off socket, and prints them.
+
+    The observer thread only notes new files. One worker waits until each is
+    completely written and queues it, another prints from the queue. Pages
+    handed over in memory go straight into the queue.
+    """
+    # A file not renamed into place counts as written once its size has not
+    # changed for STABLE_INTERVAL seconds; give up on it after WRITE_TIMEOUT
+    STABLE_INTERVAL = 0.1
+    WRITE_TIMEOUT = 10
+
+    def __init__(self, printer, batch_window=0, folder='.'):
         self.printer = printer
-        self.processed_filenames = set()  # Track filenames instead of full paths
+        self.batch_window = batch_window
+        self.queue = PrintQueue()
+        self.arrivals = queue.Queue()  # (path, whether it was renamed into place)
+        self.processed = ProcessedLog(folder=folder)  # Track filenames instead of full paths
         self.valid_extensions = {'.png', '.jpg', '.jpeg'}
-        
-        # Load processed filenames from history if exists
-        if os.path.exists('processed_files.json'):
-            with open('processed_files.json', 'r') as f:
-                self.processed_filenames = set(json.load(f))
 
-    def save_processed_files(self):
-        """Save processed filenames to JSON"""
-        with open('processed_files.json', 'w') as f:
-            json.dump(list(self.processed_filenames), f)
+    def start(self):
+        Thread(target=self.arrival_loop, daemon=True).start()
+        Thread(target=self.print_loop, daemon=True).start()
+
+    def listen(self, port):
+        """Take pages from Sender and Receiver on this host over a local socket"""
+        listener = Listener(('localhost', port), authkey=AUTHKEY)
+        Thread(target=self.accept_loop, args=(listener,), daemon=True).start()
+        print(f"Taking pages on port {port}")
+
+    def accept_loop(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                print(f"Rejected a hand-off connection: {e}")
+                continue
+            Thread(target=self.receive_pages, args=(connection,), daemon=True).start()
+
+    def receive_pages(self, connection):
+        with connection:
+            while True:
+                try:
+                    name, image, priority, supersede = unpack_page(connection.recv_bytes(MAX_PAGE_BYTES))
+                except (EOFError, OSError):
+                    return
+                except ProtocolError as e:
+                    print(f"Dropping a hand-off connection: {e}")
+                    return
+                print(f"New image handed over: {name}")
+                self.queue.put(Page(name, image), priority, supersede)
 
     def on_created(self, event):
         if not event.is_directory:
-            filepath = event.src_path
-            filename = os.path.basename(filepath)
-            file_extension = os.path.splitext(filename)[1].lower()
-            
-            # Check if file is an image and filename wasn't already processed
-            if file_extension in self.valid_extensions and filename not in self.processed_filenames:
-                print(f"New image detected: {filename}")
-                
-                # Wait a moment to ensure file is completely written
-                time.sleep(1)
-                
-                # Print image
-                self.printer.print_image(filepath)
-                
-                # Mark filename as processed
-                self.processed_filenames.add(filename)
-                self.save_processed_files()
-
-def list_printers():
-    """List all available printers on the system"""
-    return [printer[2] for printer in win32print.EnumPrinters(2)]
+            self.note(event.src_path, renamed=False)
+
+    def on_moved(self, event):
+        # Producers write to a temporary name and rename the finished file
+        if not event.is_directory:
+            self.note(event.dest_path, renamed=True)
+
+    def note(self, filepath, renamed):
+        filename = os.path.basename(filepath)
+        file_extension = os.path.splitext(filename)[1].lower()
+
+        # Check if file is an image and filename wasn't already processed
+        if file_extension in self.valid_extensions and filename not in self.processed:
+            print(f"New image detected: {filename}")
+            self.arrivals.put((filepath, renamed))
+
+    def wait_until_written(self, filepath):
+        """Wait for a file to stop growing; False if it vanished or never settled"""
+        last_size = -1
+        deadline = time.time() + self.WRITE_TIMEOUT
+        while time.time() < deadline:
+            try:
+                size = os.path.getsize(filepath)
+            except OSError:
+                return False
+            if size == last_size and size > 0:
+                return True
+            last_size = size
+            time.sleep(self.STABLE_INTERVAL)
+        return False
+
+    def arrival_loop(self):
+        while True:
+            filepath, renamed = self.arrivals.get()
+            if not renamed and not self.wait_until_written(filepath):
+                # Superseded ACKs get deleted by the receiver before they are printed
+                print(f"Skipping {os.path.basename(filepath)}, it was removed or never finished")
+                continue
+
+            # Queue it behind anything more urgent
+            priority, supersede = read_tags(filepath)
+            self.queue.put(filepath, priority, supersede)
+
+    def print_loop(self):
+        """Print queued images, most urgent first, for as long as the program runs"""
+        while True:
+            pages = [self.queue.get()]
+
+            # Batch it with whatever else arrives shortly
+            if self.batch_window > 0:
+                time.sleep(self.batch_window)
+                pages += self.queue.get_all()
+
+            # Superseded ACK files may have been removed while they waited
+            pages = [page for page in pages if isinstance(page, Page) or os.path.exists(page)]
+            if not pages:
+                continue
+
+            # Print images
+            if self.batch_window > 0:
+                self.printer.print_batch(pages)
+            else:
+                self.printer.print_image(pages[0])
+
+            # Mark filenames as processed
+            self.processed.add(page_name(page) for page in pages if not isinstance(page, Page))
 
 def main():
+    parser = argparse.ArgumentParser(description='Print images as they appear in this folder')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=default_backend(), help='How to reach the printer')
+    parser.add_argument('--printer', help='Printer name, instead of the preset choice from the list')
+    parser.add_argument('--sink-dir', default='printed', help='Where the sink backend puts printed jobs')
+    parser.add_argument('--sink-format', choices=('pdf', 'png'), default='pdf', help='File format of the sink backend')
+    parser.add_argument('--pages-per-minute', type=float, default=0, help='Printer speed the sink backend imitates')
+    parser.add_argument('--job-setup', type=float, default=0.0, help='Seconds per job the sink backend imitates')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI,
+                        help='Printer resolution for the cups and sink backends; win32 asks the printer')
+    parser.add_argument('--batch-window', type=float, default=0,
+                        help='Collect images for this many seconds and print them together, several per page')
+    parser.add_argument('--min-module-mm', type=float, default=1.0, help='Smallest QR module printed in a batch')
+    parser.add_argument('--listen-port', type=int, default=PRINT_PORT,
+                        help='Local port Sender and Receiver hand pages to; 0 to only watch the folder')
+
+    args = parser.parse_args()
+    if args.backend == 'sink':
+        backend = make_backend('sink', sink_dir=args.sink_dir, dpi=args.dpi, output_format=args.sink_format,
+                               pages_per_minute=args.pages_per_minute, job_setup=args.job_setup)
+    else:
+        backend = make_backend(args.backend, args.printer, dpi=args.dpi)
+
     # List available printers
     print("Available printers:")
-    printers = list_printers()
+    printers = backend.list_printers()
     for i, printer in enumerate(printers, 1):
         print(f"{i}. {printer}")
     
     # Get user input for printer selection
+    # The preset is a position in this host's Windows printer list; CUPS
+    # keeps its own default destination unless --printer names one
     choice = '3'
-    selected_printer = None
-    if choice.isdigit() and 1 <= int(choice) <= len(printers):
-        selected_printer = printers[int(choice)-1]
+    if args.printer is None and args.backend == 'win32' and choice.isdigit() and 1 <= int(choice) <= len(printers):
+        backend.printer_name = printers[int(choice)-1]
     
     # Get folder to monitor
     folder_to_watch = '.'
@@ -130,8 +232,11 @@ def main():
         os.makedirs(folder_to_watch)
     
     # Initialize printer and event handler
-    printer = ImagePrinter(selected_printer)
-    event_handler = FileHandler(printer)
+    printer = ImagePrinter(backend=backend, min_module_mm=args.min_module_mm)
+    event_handler = FileHandler(printer, args.batch_window, folder_to_watch)
+    event_handler.start()
+    if args.listen_port:
+        event_handler.listen(args.listen_port)
     
     # Set up observer
     observer = Observer()
@@ -147,6 +252,7 @@ def main():
     except KeyboardInterrupt:
         observer.stop()
         observer.join()
+        event_handler.processed.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,31 +1,115 @@
-import cv2
-import numpy as np
 import socket
-import pickle
-import struct
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.frame_protocol import (
+    HEADER, PAYLOAD, PAYLOADS_HEADER, REQUEST, Payload, pack_subscribe, unpack_header, unpack_payloads_header
+)
+from camera.frame_ring import FrameRing, ring_name
 
 class CameraClient:
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, backend='tcp', mode='latest', queue_depth=1, camera=0):
+        """backend 'shm' maps frames from a CameraServer on this host started
+        with --shm; 'tcp' works for remote servers too.
+
+        Over TCP, mode 'latest' asks for the newest frame on every call, so a
+        slow consumer never sees stale frames; mode 'queue' has the server push
+        every frame, keeping at most queue_depth of them for this client.
+        Mode 'payloads' receives the QR codes the server decoded from all its
+        cameras instead of frames, through get_payloads(); otherwise `camera`
+        picks which of the server's cameras to watch.
+        """
+        self.backend = backend
+        self.mode = mode
+
+        # Capture sequence number and timestamp of the last frame returned,
+        # and how many captured frames this client never saw
+        self.frame_seq = 0
+        self.frame_timestamp = 0.0
+        self.skipped_frames = 0
+
+        if backend == 'shm':
+            self.ring = FrameRing.attach(ring_name(port, camera))
+            self.frame = np.empty(self.ring.shape, dtype=self.ring.dtype)
+            return
+
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if mode == 'queue':
+            # Frames waiting in our receive buffer would be older than the queue allows
+            self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
         self.client_socket.connect((host, port))
-        self.data = b""
-        self.payload_size = struct.calcsize("L")
-        
-    def get_frame(self):
-        while len(self.data) < self.payload_size:
-            self.data += self.client_socket.recv(4096)
-            
-        packed_msg_size = self.data[:self.payload_size]
-        self.data = self.data[self.payload_size:]
-        msg_size = struct.unpack("L", packed_msg_size)[0]
-        
-        while len(self.data) < msg_size:
-            self.data += self.client_socket.recv(4096)
-            
-        frame_data = self.data[:msg_size]
-        self.data = self.data[msg_size:]
-        
-        return pickle.loads(frame_data)
-        
+        self.client_socket.sendall(pack_subscribe(mode, queue_depth, camera))
+        self.header = bytearray(max(HEADER.size, PAYLOADS_HEADER.size))
+        self.buffer = bytearray()
+
+    def _recv_into(self, view):
+        while len(view):
+            received = self.client_socket.recv_into(view)
+            if received == 0:
+                raise ConnectionError("CameraServer closed the connection")
+            view = view[received:]
+
+    def _track(self, seq, timestamp):
+        if self.frame_seq and seq > self.frame_seq + 1:
+            self.skipped_frames += seq - self.frame_seq - 1
+        self.frame_seq = seq
+        self.frame_timestamp = timestamp
+
+    def frame_age(self):
+        """Seconds since the last returned frame was captured; assumes the
+        server's clock agrees with ours, which it does on the same host"""
+        return time.time() - self.frame_timestamp
+
+    def get_frame(self, timeout=None):
+        """Return the next frame.
+
+        The frame is a view into a buffer that is reused by later calls, so
+        copy it if it has to outlive the next one. With the shm backend it is
+        copied out of the ring, so the server cannot overwrite it while it is
+        in use; `timeout` raises TimeoutError if no new frame comes in time.
+        """
+        if self.backend == 'shm':
+            seq, timestamp, frame = self.ring.wait_for_frame(self.frame_seq, timeout, out=self.frame)
+            self._track(seq, timestamp)
+            return frame
+
+        if self.mode == 'latest':
+            self.client_socket.sendall(REQUEST)
+
+        self._recv_into(memoryview(self.header)[:HEADER.size])
+        dtype, shape, length, seq, timestamp = unpack_header(self.header[:HEADER.size])
+        self._track(seq, timestamp)
+
+        if len(self.buffer) < length:
+            self.buffer = bytearray(length)
+        self._recv_into(memoryview(self.buffer)[:length])
+
+        return np.frombuffer(self.buffer, dtype=dtype, count=length // dtype.itemsize).reshape(shape)
+
+    def get_payloads(self):
+        """Return the new Payloads the server decoded from its next frame,
+        which may be none; only for mode 'payloads'"""
+        self._recv_into(memoryview(self.header)[:PAYLOADS_HEADER.size])
+        seq, timestamp, count = unpack_payloads_header(self.header[:PAYLOADS_HEADER.size])
+        self._track(seq, timestamp)
+
+        payloads = []
+        record = bytearray(PAYLOAD.size)
+        for _ in range(count):
+            self._recv_into(memoryview(record))
+            camera, left, top, width, height, length = PAYLOAD.unpack(record)
+            data = bytearray(length)
+            self._recv_into(memoryview(data))
+            payloads.append(Payload(bytes(data), camera, (left, top, width, height), seq, timestamp))
+
+        return payloads
+
     def close(self):
-        self.client_socket.close()
\ No newline at end of file
+        if self.backend == 'shm':
+            self.ring.close()
+        else:
+            self.client_socket.close()
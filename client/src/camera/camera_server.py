@@ -1,20 +1,51 @@
 import cv2
 import numpy as np
 import socket
-import pickle
-import struct
 import argparse
-from threading import Thread
+import time
+from collections import deque, namedtuple
+from threading import Condition, Lock, Thread
 import logging
 import sys
+from pathlib import Path
+from pyzbar.pyzbar import decode
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.frame_protocol import (
+    MODE_LATEST, MODE_PAYLOADS, SUBSCRIBE, pack_header, pack_payloads, unpack_subscribe
+)
+from camera.frame_ring import FrameRing, ring_name
+from camera.frame_sources import FrameRecorder, open_source
+
+# One captured frame as published to every subscriber; header is packed once
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image', 'header'])
 
 class CameraServer:
-    def __init__(self, host='localhost', port=5000, camera_id=0, show_preview=False, resolution=None):
+    # Most frames kept for clients subscribed with a queue, whatever depth
+    # they ask for; a 1080p frame is about 6 MB
+    MAX_QUEUE_DEPTH = 8
+    SOCKET_BUFFER = 64 * 1024
+
+    # Decoded frames kept for payload subscribers that are slow to read them
+    PAYLOAD_BACKLOG = 64
+    # A code seen again within this many seconds, by any camera, is not
+    # published again
+    DEDUP_WINDOW = 1.0
+
+    def __init__(self, host='localhost', port=5000, camera_id=0, show_preview=False, resolution=None, camera=None, shm=False, decode=False, speed=1.0, loop=False, record=None):
         self.host = host
         self.port = port
-        self.camera_id = camera_id
+        # One or more camera indices or other frame sources (see
+        # frame_sources.open_source); several cameras cover a wider landing area
+        self.camera_ids = list(camera_id) if isinstance(camera_id, (list, tuple)) else [camera_id]
+        self.camera_id = self.camera_ids[0]
         self.show_preview = show_preview
         self.resolution = resolution
+        self.shm = shm
+        self.rings = {}
+        self.decode = decode
+        self.decode_threads = None
+        self.decode_lock = Lock()
         
         # Setup logging
         self.logger = logging.getLogger('CameraServer')
@@ -25,30 +56,70 @@ class CameraServer:
         
         # Initialize server socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A restarted server can take its port back while old connections linger
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
         
-        # Initialize camera
-        self.camera = cv2.VideoCapture(self.camera_id)
-        if not self.camera.isOpened():
-            raise RuntimeError(f"Could not open camera {self.camera_id}")
+        # Initialize cameras, unless we were handed VideoCapture-like objects
+        if camera is None:
+            self.cameras = [open_source(i, speed, loop) for i in self.camera_ids]
+        else:
+            self.cameras = list(camera) if isinstance(camera, (list, tuple)) else [camera]
+        for index, device in enumerate(self.cameras):
+            if not device.isOpened():
+                raise RuntimeError(f"Could not open camera {self.camera_ids[index] if camera is None else index}")
+
+        # Save what the cameras see, one image directory per camera
+        if record:
+            self.cameras = [
+                FrameRecorder(device, Path(record) / f"camera_{index}" if len(self.cameras) > 1 else record)
+                for index, device in enumerate(self.cameras)
+            ]
+        self.camera = self.cameras[0]
             
         # Set resolution if specified
         if self.resolution:
             width, height = self.resolution
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            for device in self.cameras:
+                device.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                device.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
         
         self.running = True
         self.clients = []
+
+        # Most recent captured frames of each camera, appended by its capture
+        # loop and read by every subscriber, so only one thread ever touches
+        # a camera
+        self.recent_frames = [deque(maxlen=self.MAX_QUEUE_DEPTH) for _ in self.cameras]
+        self.frame_ready = Condition()
+        self.capturing = len(self.cameras)
+
+        # (message seq, packed message) of the QR codes found in decoded
+        # frames of all cameras, and when each code was last published
+        self.recent_payloads = deque(maxlen=self.PAYLOAD_BACKLOG)
+        self.payloads_ready = Condition()
+        self.payload_seq = 0
+        self.last_published = {}
         
     def start(self):
         """Start the camera server"""
         self.logger.info(f"Starting camera server on {self.host}:{self.port}")
-        self.logger.info(f"Camera ID: {self.camera_id}")
+        self.logger.info(f"Camera ID: {', '.join(map(str, self.camera_ids))}")
         if self.resolution:
             self.logger.info(f"Resolution: {self.resolution[0]}x{self.resolution[1]}")
         
+        # Start the capture loops before anyone subscribes
+        self.capture_threads = [
+            Thread(target=self.capture_loop, args=(index,), daemon=True) for index in range(len(self.cameras))
+        ]
+        for thread in self.capture_threads:
+            thread.start()
+
+        # Decode right away if asked to, otherwise when a client wants payloads
+        if self.decode:
+            self.start_decoding()
+
         # Start accepting client connections
         Thread(target=self.accept_clients).start()
         
@@ -71,34 +142,191 @@ class CameraServer:
                     self.logger.error(f"Error accepting client: {e}")
     
     def show_camera_preview(self):
-        """Show local preview of the camera feed"""
+        """Show local preview of the camera feeds"""
         self.logger.info("Starting camera preview")
+        last_seq = 0
         while self.running:
-            ret, frame = self.camera.read()
-            if ret:
-                cv2.imshow('Camera Preview', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    self.logger.info("Preview window closed")
-                    break
+            frames = self.wait_for_frames(last_seq)
+            if frames is None:
+                break
+            last_seq = frames[-1].seq
+            cv2.imshow('Camera Preview', frames[-1].image)
+
+            # Other cameras show whatever they captured last
+            for index in range(1, len(self.cameras)):
+                with self.frame_ready:
+                    frame = self.recent_frames[index][-1] if self.recent_frames[index] else None
+                if frame is not None:
+                    cv2.imshow(f'Camera Preview {index}', frame.image)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.logger.info("Preview window closed")
+                break
         
         cv2.destroyAllWindows()
             
+    def capture_loop(self, index=0):
+        """Read a camera and publish each frame once to every subscriber"""
+        seq = 0
+        while self.running:
+            ret, image = self.cameras[index].read()
+            if not ret:
+                self.logger.error(f"Failed to read from camera {index}")
+                break
+
+            seq += 1
+            timestamp = time.time()
+            image = np.ascontiguousarray(image)
+
+            # Publish frames to consumers on this host through shared memory
+            if self.shm:
+                if index not in self.rings:
+                    name = ring_name(self.port, index)
+                    self.rings[index] = FrameRing.create(name, image.shape, image.dtype)
+                    self.logger.info(f"Frame ring {name} for {image.shape} frames")
+                self.rings[index].write(image, timestamp)
+
+            with self.frame_ready:
+                self.recent_frames[index].append(Frame(seq, timestamp, image, pack_header(image, seq, timestamp)))
+                self.frame_ready.notify_all()
+
+        # The server keeps going on the cameras that still work; once none
+        # does, wake subscribers so they notice
+        with self.frame_ready:
+            self.capturing -= 1
+            if self.capturing == 0:
+                self.running = False
+            self.frame_ready.notify_all()
+        with self.payloads_ready:
+            self.payloads_ready.notify_all()
+
+    def wait_for_frames(self, last_seq, depth=1, index=0):
+        """Block until frames of a camera newer than last_seq are published and
+        return up to `depth` of the newest, oldest first, or None on shutdown"""
+        recent = self.recent_frames[index]
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: not self.running or (recent and recent[-1].seq > last_seq))
+            if not self.running:
+                return None
+            return [frame for frame in recent if frame.seq > last_seq][-depth:]
+
+    def start_decoding(self):
+        with self.decode_lock:
+            if self.decode_threads is None:
+                self.logger.info("Decoding QR codes at the source")
+                self.decode_threads = [
+                    Thread(target=self.decode_loop, args=(index,), daemon=True) for index in range(len(self.cameras))
+                ]
+                for thread in self.decode_threads:
+                    thread.start()
+
+    def decode_loop(self, index=0):
+        """Decode the newest frame of a camera once for all payload subscribers"""
+        last_seq = 0
+        while self.running:
+            frames = self.wait_for_frames(last_seq, index=index)
+            if frames is None:
+                break
+            frame = frames[-1]
+            last_seq = frame.seq
+
+            codes = [(qr.data, tuple(qr.rect)) for qr in decode(frame.image)]
+            self.publish_payloads(index, frame.timestamp, codes)
+
+    def publish_payloads(self, index, timestamp, codes):
+        """Merge the codes one camera decoded into the payload stream, leaving
+        out those any camera reported within DEDUP_WINDOW"""
+        with self.payloads_ready:
+            fresh = []
+            for data, rect in codes:
+                if timestamp - self.last_published.get(data, float('-inf')) >= self.DEDUP_WINDOW:
+                    self.last_published[data] = timestamp
+                    fresh.append((index, data, rect))
+
+            # Forget codes that are out of the window
+            if len(self.last_published) > 4 * self.PAYLOAD_BACKLOG:
+                self.last_published = {
+                    data: seen for data, seen in self.last_published.items()
+                    if timestamp - seen < self.DEDUP_WINDOW
+                }
+
+            # Frames without new codes are still published, so consumers
+            # waiting on the stream get to run their timers
+            self.payload_seq += 1
+            self.recent_payloads.append((self.payload_seq, pack_payloads(self.payload_seq, timestamp, fresh)))
+            self.payloads_ready.notify_all()
+
+    def wait_for_payloads(self, last_seq):
+        """Block until messages newer than last_seq are published and return
+        their (seq, message) pairs, oldest first, or None on shutdown"""
+        with self.payloads_ready:
+            self.payloads_ready.wait_for(
+                lambda: not self.running or (self.recent_payloads and self.recent_payloads[-1][0] > last_seq)
+            )
+            if not self.running:
+                return None
+            return [entry for entry in self.recent_payloads if entry[0] > last_seq]
+
+    def serve_payloads(self, client_socket):
+        """Push the codes found in every decoded frame to a payload subscriber"""
+        self.start_decoding()
+        # Start from what is published next, as frame subscribers start from
+        # the newest frame; the backlog is old sightings to a new subscriber
+        with self.payloads_ready:
+            last_seq = self.payload_seq
+        while self.running:
+            messages = self.wait_for_payloads(last_seq)
+            if messages is None:
+                break
+            for last_seq, message in messages:
+                client_socket.sendall(message)
+
+    def receive_exactly(self, client_socket, size):
+        """Read `size` bytes from a client, or None if it disconnected"""
+        data = b''
+        while len(data) < size:
+            chunk = client_socket.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
     def handle_client(self, client_socket):
         """Handle individual client connection"""
         try:
+            subscription = self.receive_exactly(client_socket, SUBSCRIBE.size)
+            if subscription is None:
+                return
+            mode, depth, index = unpack_subscribe(subscription)
+            if mode == MODE_PAYLOADS:
+                self.serve_payloads(client_socket)
+                return
+
+            depth = 1 if mode == MODE_LATEST else min(depth, self.MAX_QUEUE_DEPTH)
+            if index >= len(self.cameras):
+                self.logger.error(f"Client asked for camera {index}, only {len(self.cameras)} open")
+                return
+            if mode != MODE_LATEST:
+                # Keep the kernel from buffering frames beyond the queue
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SOCKET_BUFFER)
+
+            last_seq = 0
             while self.running:
-                ret, frame = self.camera.read()
-                if not ret:
-                    self.logger.error("Failed to read from camera")
+                # Latest-only clients pull, so nothing queues up in the socket
+                # while they are busy decoding
+                if mode == MODE_LATEST:
+                    if self.receive_exactly(client_socket, 1) is None:
+                        break
+
+                frames = self.wait_for_frames(last_seq, depth, index)
+                if frames is None:
                     break
-                    
-                # Serialize frame
-                data = pickle.dumps(frame)
-                message_size = struct.pack("L", len(data))
-                
-                # Send frame size followed by frame data
-                client_socket.sendall(message_size + data)
-                
+
+                for frame in frames:
+                    # Send header followed by the raw pixels, without copying them
+                    client_socket.sendall(frame.header)
+                    client_socket.sendall(memoryview(frame.image).cast('B'))
+                    last_seq = frame.seq
+
         except Exception as e:
             self.logger.error(f"Error handling client: {e}")
         finally:
@@ -107,7 +335,11 @@ class CameraServer:
     def stop(self):
         """Stop the camera server and cleanup resources"""
         self.logger.info("Stopping camera server")
-        self.running = False
+        with self.frame_ready:
+            self.running = False
+            self.frame_ready.notify_all()
+        with self.payloads_ready:
+            self.payloads_ready.notify_all()
         
         # Close all client connections
         for client_socket, _ in self.clients:
@@ -116,15 +348,28 @@ class CameraServer:
             except:
                 pass
         
-        # Close server socket
+        # Close server socket; shutting it down first wakes the blocked accept()
+        try:
+            self.server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         try:
             self.server_socket.close()
         except:
             pass
         
-        # Release camera
-        if self.camera is not None:
-            self.camera.release()
+        # Let the capture loops finish their frames before tearing things down
+        for thread in getattr(self, 'capture_threads', []):
+            thread.join(timeout=1.0)
+
+        # Remove the frame rings
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+        # Release cameras
+        for device in self.cameras:
+            device.release()
         
         # Close any remaining windows
         cv2.destroyAllWindows()
@@ -155,12 +400,18 @@ def main():
     parser = argparse.ArgumentParser(description='Camera Server for shared webcam access')
     parser.add_argument('--host', default='localhost', help='Host address to bind to')
     parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
-    parser.add_argument('--camera', type=int, default=0, help='Camera device index to use')
+    parser.add_argument('--camera', nargs='+', default=['0'],
+                        help='Camera device indices, video files, image directories or synthetic[:WxH[@FPS]]')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed of recorded sources, 0 for as fast as possible')
+    parser.add_argument('--loop', action='store_true', help='Replay recorded sources over and over')
+    parser.add_argument('--record', help='Save the captured frames to this directory')
     parser.add_argument('--preview', action='store_true', help='Show camera preview window')
     parser.add_argument('--width', type=int, help='Camera resolution width')
     parser.add_argument('--height', type=int, help='Camera resolution height')
     parser.add_argument('--list-cameras', action='store_true', help='List available cameras and exit')
     parser.add_argument('--info', action='store_true', help='Show camera info and exit')
+    parser.add_argument('--shm', action='store_true', help='Also publish frames to local clients through shared memory')
+    parser.add_argument('--decode', action='store_true', help='Decode QR codes from the start instead of on first request')
     
     args = parser.parse_args()
     
@@ -182,7 +433,12 @@ def main():
             port=args.port,
             camera_id=args.camera,
             show_preview=args.preview,
-            resolution=resolution
+            resolution=resolution,
+            shm=args.shm,
+            decode=args.decode,
+            speed=args.speed,
+            loop=args.loop,
+            record=args.record
         )
         
         # Show camera info if requested
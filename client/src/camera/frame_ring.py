@@ -0,0 +1,230 @@
+"""Shared-memory frame ring for consumers on the same host as CameraServer.
+
+The capture loop writes each frame into the next of a few fixed slots and
+bumps a sequence counter. Readers find the newest slot without any socket
+traffic. A view straight into a slot is only good until the writer comes
+round to it again, ``slots - 1`` frames later (about 100 ms at 30 fps with
+the default 4 slots), and nothing stops the writer; check ``is_current``
+after using one. Passing ``out`` copies the frame into the reader's own
+buffer instead and retries if the slot was overwritten during the copy, so
+the result cannot be torn. CameraClient reads that way.
+
+Layout: a control block (HEADER) followed by ``slots`` slots, each a
+SLOT_HEADER (sequence number, capture timestamp) and the frame bytes.
+"""
+import argparse
+import json
+import struct
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.frame_protocol import DTYPE_CODES, DTYPES
+
+MAGIC = b"RNG1"
+
+# magic, slots, height, width, channels, dtype code, latest sequence number
+HEADER = struct.Struct("<4sIIIIB3xQ")
+LATEST_OFFSET = HEADER.size - 8
+
+# sequence number (0 while being written), capture timestamp
+SLOT_HEADER = struct.Struct("<Qd")
+
+
+def ring_name(port, camera=0):
+    return f"paper_camera_{port}" if camera == 0 else f"paper_camera_{port}_{camera}"
+
+
+class FrameRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+        magic, self.slots, height, width, channels, dtype_code, _ = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC:
+            raise RuntimeError(f"{shm.name} is not a frame ring")
+
+        self.dtype = DTYPES[dtype_code]
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.frame_size = self.dtype.itemsize * int(np.prod(self.shape))
+        self.slot_size = SLOT_HEADER.size + self.frame_size
+
+    @classmethod
+    def create(cls, name, shape, dtype=np.uint8, slots=4):
+        """Create a ring for frames of one shape; the creator is the only writer"""
+        dtype = np.dtype(dtype)
+        channels = shape[2] if len(shape) == 3 else 1
+        frame_size = dtype.itemsize * int(np.prod(shape))
+        size = HEADER.size + slots * (SLOT_HEADER.size + frame_size)
+
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()  # Left over from a server that crashed
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, slots, shape[0], shape[1], channels, DTYPE_CODES[dtype], 0)
+        for slot in range(slots):
+            SLOT_HEADER.pack_into(shm.buf, HEADER.size + slot * (SLOT_HEADER.size + frame_size), 0, 0.0)
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the segment with the
+            # resource tracker, which would unlink it when this process exits
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+        return cls(shm, owner=False)
+
+    def _slot_offset(self, seq):
+        return HEADER.size + (seq % self.slots) * self.slot_size
+
+    def _frame_view(self, seq):
+        offset = self._slot_offset(seq) + SLOT_HEADER.size
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=offset)
+
+    def latest_seq(self):
+        return struct.unpack_from("<Q", self.shm.buf, LATEST_OFFSET)[0]
+
+    def write(self, frame, timestamp=None):
+        seq = self.latest_seq() + 1
+        offset = self._slot_offset(seq)
+
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 0, 0.0)
+        np.copyto(self._frame_view(seq), frame.reshape(self.shape))
+        SLOT_HEADER.pack_into(self.shm.buf, offset, seq, time.time() if timestamp is None else timestamp)
+        struct.pack_into("<Q", self.shm.buf, LATEST_OFFSET, seq)
+
+        return seq
+
+    def read_latest(self, out=None):
+        """Return (seq, timestamp, frame) of the newest frame, or None.
+
+        Without `out` the frame is a view into the ring, see the module
+        docstring for how long it lasts. With `out`, an array of the ring's
+        shape and dtype, the frame is copied into it and checked afterwards.
+        """
+        while True:
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+
+            slot_seq, timestamp = SLOT_HEADER.unpack_from(self.shm.buf, self._slot_offset(seq))
+            if slot_seq == seq:
+                if out is None:
+                    return seq, timestamp, self._frame_view(seq)
+                np.copyto(out, self._frame_view(seq))
+                if self.is_current(seq):
+                    return seq, timestamp, out
+            # The writer lapped us while we were reading, try the new latest
+
+    def wait_for_frame(self, after_seq, timeout=None, poll=0.001, out=None):
+        """Block until a frame newer than after_seq is available"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.latest_seq() <= after_seq:
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError("No new frame in the ring")
+            time.sleep(poll)
+
+        return self.read_latest(out)
+
+    def is_current(self, seq):
+        """Whether the view returned for seq has not been overwritten yet"""
+        return SLOT_HEADER.unpack_from(self.shm.buf, self._slot_offset(seq))[0] == seq
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Frame views are still alive, the mapping goes with them
+        if self.owner:
+            self.shm.unlink()
+
+
+def consume(backend, port, frames):
+    """Benchmark consumer: read frames and report latency and CPU time"""
+    from camera.camera_client import CameraClient
+
+    client = CameraClient(port=port, backend=backend)
+    latencies = []
+    try:
+        client.get_frame()  # Warm up
+        cpu_start, wall_start = time.process_time(), time.time()
+        for _ in range(frames):
+            frame = client.get_frame()
+            stamp = struct.unpack("<d", frame.reshape(-1)[:8].tobytes())[0]
+            latencies.append(time.time() - stamp)
+        cpu, wall = time.process_time() - cpu_start, time.time() - wall_start
+    finally:
+        client.close()
+
+    latencies.sort()
+    return {
+        "backend": backend,
+        "frames": frames,
+        "fps": frames / wall,
+        "latency_ms_median": 1000 * latencies[len(latencies) // 2],
+        "latency_ms_p95": 1000 * latencies[int(0.95 * len(latencies))],
+        "cpu_percent": 100 * cpu / wall,
+    }
+
+
+def benchmark(frames, width, height, fps, port):
+    """Serve a synthetic camera over both transports and consume from each"""
+    from camera.camera_server import CameraServer
+    from camera.frame_sources import SyntheticSource
+
+    server = CameraServer(port=port, camera=SyntheticSource(width, height, fps), shm=True)
+    server.start()
+    results = []
+    try:
+        for backend in ("tcp", "shm"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--consume", backend, "--port", str(port), "--frames", str(frames)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+    finally:
+        server.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory frame ring tools")
+    parser.add_argument("--benchmark", action="store_true", help="Compare the socket and shared-memory paths")
+    parser.add_argument("--consume", choices=("tcp", "shm"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=5099, help="Port for the benchmark server")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to read per backend")
+    parser.add_argument("--width", type=int, default=1920, help="Synthetic frame width")
+    parser.add_argument("--height", type=int, default=1080, help="Synthetic frame height")
+    parser.add_argument("--fps", type=int, default=30, help="Synthetic frame rate")
+
+    args = parser.parse_args()
+
+    if args.consume:
+        print(json.dumps(consume(args.consume, args.port, args.frames)))
+    elif args.benchmark:
+        for result in benchmark(args.frames, args.width, args.height, args.fps, args.port):
+            print(
+                f"{result['backend']}: {result['fps']:.1f} fps, latency median {result['latency_ms_median']:.2f} ms, "
+                f"p95 {result['latency_ms_p95']:.2f} ms, consumer CPU {result['cpu_percent']:.1f}%"
+            )
+
+
+if __name__ == "__main__":
+    main()
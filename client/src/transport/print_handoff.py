@@ -0,0 +1,189 @@
+"""How Sender, Receiver and the tuner hand pages to the printer.
+
+PrintHandoff sends each page to the printer service over a local socket:
+black-and-white codes as their module matrix, one pixel per module, colour
+codes as the rendered image. Where the printer is not listening, or with
+port 0, pages become PNG files in the printing directory instead, written
+under a temporary name and renamed into place so the printer never opens a
+half-written one. The simulated channel only sees pages as files.
+
+On the socket each page is one message: a fixed-width PAGE header, the UTF-8
+name and supersede key, then the raw pixel rows. Nothing is unpickled, so
+the printer runs no code it is sent.
+
+Each page carries a print priority, in a PNG text chunk for files, so the
+printer can order its queue without knowing anything about packets. Lower
+priorities print first: a cumulative ACK releases the peer's whole window, a
+retransmission fills the hole the peer is stuck on, and new data can wait.
+Pages with the same supersede key replace each other while queued, the
+newest winning.
+"""
+import os
+import struct
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from pathlib import Path
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+PRIORITY_ACK = 0
+PRIORITY_RETRANSMISSION = 1
+PRIORITY_DATA = 2
+
+PRIORITY_CHUNK = "priority"
+SUPERSEDE_CHUNK = "supersede"
+
+# Pages being written end in this, which the printer and sim_camera ignore
+PARTIAL_SUFFIX = ".part"
+
+PRINT_PORT = 6000
+# Only keeps other local programs from feeding the printer by accident
+AUTHKEY = b"paper-airplanes"
+# Module matrices saved as files are drawn at this size, as qrcode would
+FILE_BOX_SIZE = 10
+
+PAGE_MAGIC = b"PRT1"
+
+# magic, priority, image mode code, width, height, name length, supersede
+# key length (0 for none)
+PAGE = struct.Struct("<4sBBIIHH")
+
+# 1-bit rows are packed eight pixels to a byte, as PIL stores them
+MODES = {0: "1", 1: "L", 2: "RGB"}
+MODE_CODES = {mode: code for code, mode in MODES.items()}
+
+# Largest message the printer accepts, well above a full page in RGB
+MAX_PAGE_BYTES = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def pack_page(image, name, priority, supersede=None):
+    if image.mode not in MODE_CODES:
+        image = image.convert("RGB")
+    name = name.encode("utf-8")
+    supersede = supersede.encode("utf-8") if supersede is not None else b""
+    header = PAGE.pack(PAGE_MAGIC, priority, MODE_CODES[image.mode], *image.size, len(name), len(supersede))
+    return header + name + supersede + image.tobytes()
+
+
+def unpack_page(message):
+    """(name, image, priority, supersede key or None) of a PAGE message"""
+    if len(message) < PAGE.size:
+        raise ProtocolError("Short page message")
+    magic, priority, mode, width, height, name_length, supersede_length = PAGE.unpack_from(message)
+    if magic != PAGE_MAGIC:
+        raise ProtocolError(f"Bad page magic {magic!r}")
+    if mode not in MODES:
+        raise ProtocolError(f"Unknown image mode {mode}")
+
+    mode = MODES[mode]
+    row_bytes = (width + 7) // 8 if mode == "1" else width * Image.getmodebands(mode)
+    start = PAGE.size + name_length + supersede_length
+    if len(message) != start + row_bytes * height:
+        raise ProtocolError(f"Page message of {len(message)} bytes does not match its header")
+
+    try:
+        name = message[PAGE.size : PAGE.size + name_length].decode("utf-8")
+        supersede = message[PAGE.size + name_length : start].decode("utf-8") or None
+    except UnicodeDecodeError as e:
+        raise ProtocolError(f"Bad page name: {e}") from e
+
+    image = Image.frombytes(mode, (width, height), message[start:])
+    return os.path.basename(name), image, priority, supersede
+
+
+def print_tags(priority, supersede=None):
+    """PngInfo to pass as `pnginfo` when saving a page"""
+    info = PngInfo()
+    info.add_text(PRIORITY_CHUNK, str(priority))
+    if supersede is not None:
+        info.add_text(SUPERSEDE_CHUNK, supersede)
+    return info
+
+
+def read_tags(path):
+    """(priority, supersede key) of a page; untagged images count as new data"""
+    try:
+        with Image.open(path) as image:
+            info = image.info
+    except OSError:
+        return PRIORITY_DATA, None
+
+    try:
+        priority = int(info.get(PRIORITY_CHUNK, PRIORITY_DATA))
+    except ValueError:
+        priority = PRIORITY_DATA
+    return priority, info.get(SUPERSEDE_CHUNK)
+
+
+def save_page(image, path, priority=PRIORITY_DATA, supersede=None):
+    """Save a tagged page for the printer, appearing at `path` only once complete"""
+    path = Path(path)
+    partial = path.with_name(path.name + PARTIAL_SUFFIX)
+    image.save(partial, format="PNG", pnginfo=print_tags(priority, supersede))
+    os.replace(partial, path)
+
+
+def module_matrix(qr):
+    """A made qrcode.QRCode as a 1-bit image of one pixel per module, quiet zone included"""
+    modules = qr.get_matrix()
+    matrix = Image.new("1", (len(modules), len(modules)), 1)
+    matrix.putdata([0 if dark else 1 for row in modules for dark in row])
+    return matrix
+
+
+class PrintHandoff:
+    """Hands pages to the printer service on `port`, falling back to files in
+    printing_dir while it is not listening"""
+
+    RETRY_INTERVAL = 5
+
+    def __init__(self, printing_dir, port=PRINT_PORT):
+        self.printing_dir = Path(printing_dir)
+        self.port = port
+        self.connection = None
+        self.retry_at = 0.0
+        self.warned = False
+
+    def connect(self):
+        if not self.port or time.time() < self.retry_at:
+            return None
+
+        try:
+            self.connection = Client(("localhost", self.port), authkey=AUTHKEY)
+            print(f"Handing pages to the printer on port {self.port}")
+            self.warned = False
+        except (OSError, AuthenticationError) as e:
+            if not self.warned:
+                print(f"No printer on port {self.port} ({e}), writing pages to {self.printing_dir}")
+                self.warned = True
+            self.retry_at = time.time() + self.RETRY_INTERVAL
+        return self.connection
+
+    def print_page(self, image, name, priority=PRIORITY_DATA, supersede=None):
+        """Print a module matrix (mode "1") or a rendered image under a file name"""
+        connection = self.connection or self.connect()
+        if connection is not None:
+            try:
+                connection.send_bytes(pack_page(image, name, priority, supersede))
+                return
+            except OSError as e:
+                print(f"Lost the printer ({e}), writing pages to {self.printing_dir}")
+                connection.close()
+                self.connection = None
+                self.retry_at = time.time() + self.RETRY_INTERVAL
+                self.warned = True
+
+        if image.mode == "1":
+            side = image.size[0] * FILE_BOX_SIZE
+            image = image.resize((side, side), Image.Resampling.NEAREST)
+        save_page(image, self.printing_dir / name, priority, supersede)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,250 @@
+"""Calibrates PACKET_SIZE, ERROR_CORRECTION and N for this site's hardware.
+
+A probe set of QR codes at different payload sizes and error-correction levels
+is either printed and scanned with the real printer and camera, or pushed
+through a simulated capture. Decode success is fitted as a logistic function
+of code density (modules per side) for each error-correction level, and the
+setting with the best expected payload per printed page is written to the
+profile that Sender and Receiver load at startup.
+
+    python tuner.py --simulate
+    python tuner.py --print && python tuner.py --scan 600
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import qrcode
+from pyzbar.pyzbar import decode
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from transport.print_handoff import save_page
+from transport.settings import EC_LEVELS, PROFILE_FILE, qr_fits
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+PROBE_DIR = PROJECT_ROOT / "data" / "transport" / "probes"
+MANIFEST_FILE = PROBE_DIR / "manifest.json"
+
+PROBE_SIZES = (256, 512, 768, 1024, 1536, 2048)
+HEADER_SIZE = 5  # Checksum and sequence number added around the data
+
+
+def probe_payload(probe_id, size):
+    """Base64 text of the same length a packet of this size would produce"""
+    text_size = 4 * -(-size // 3)
+    marker = f"PROBE{probe_id:05d}"
+    filler = base64.b64encode(os.urandom(text_size)).decode("ascii")
+
+    return marker + filler[: text_size - len(marker)]
+
+
+def make_probe(probe_id, size, ec):
+    qr = qrcode.QRCode(version=None, error_correction=EC_LEVELS[ec], box_size=10, border=4)
+    qr.add_data(probe_payload(probe_id, size))
+    qr.make(fit=True)
+
+    return qr, qr.make_image(fill_color="black", back_color="white")
+
+
+def probe_set(sizes, levels, repeats):
+    probes = []
+    for size in sizes:
+        for ec in levels:
+            if not qr_fits(4 * -(-size // 3), ec):
+                print(f"{size} B does not fit a QR code at {ec}, skipping it")
+                continue
+            for _ in range(repeats):
+                probes.append({"id": len(probes), "size": size, "ec": ec})
+
+    return probes
+
+
+def probe_id(data):
+    text = data.decode("ascii", errors="ignore")
+    if text.startswith("PROBE") and text[5:10].isdigit():
+        return int(text[5:10])
+    return None
+
+
+def simulate_capture(page, resolution=(1280, 720), blur=1.0, noise=10.0, rng=None):
+    """Roughly what a webcam makes of a page held up in front of it"""
+    rng = rng or np.random.default_rng()
+    width, height = resolution
+    # The page fills about 80% of the frame height
+    scale = 0.8 * height / page.shape[0]
+    page = cv2.resize(page, (int(page.shape[1] * scale), int(page.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    if blur > 0:
+        page = cv2.GaussianBlur(page, (0, 0), blur)
+    page = page.astype(np.float32) + rng.normal(0.0, noise, page.shape)
+
+    return np.clip(page, 0, 255).astype(np.uint8)
+
+
+def run_simulated(probes, resolution, blur, noise, seed):
+    rng = np.random.default_rng(seed)
+    for probe in probes:
+        qr, image = make_probe(probe["id"], probe["size"], probe["ec"])
+        page = np.array(image.convert("L"))
+        frame = simulate_capture(page, resolution, blur, noise, rng)
+        probe["modules"] = 17 + 4 * qr.version
+        probe["decoded"] = any(probe_id(code.data) == probe["id"] for code in decode(frame))
+
+    return probes
+
+
+def print_probes(probes, printing_dir):
+    """Write the probe pages for the printer and remember what was sent"""
+    PROBE_DIR.mkdir(parents=True, exist_ok=True)
+    for probe in probes:
+        qr, image = make_probe(probe["id"], probe["size"], probe["ec"])
+        probe["modules"] = 17 + 4 * qr.version
+        save_page(image, printing_dir / f"probe_{probe['id']}_{time.time_ns()}.png")
+
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(probes, f, indent=2)
+
+
+def scan_probes(duration, camera_port):
+    """Scan frames for `duration` seconds and mark which printed probes were read"""
+    from camera.camera_client import CameraClient
+
+    with open(MANIFEST_FILE) as f:
+        probes = json.load(f)
+
+    seen = set()
+    camera_client = CameraClient(port=camera_port)
+    try:
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            for code in decode(camera_client.get_frame()):
+                if probe_id(code.data) is not None:
+                    seen.add(probe_id(code.data))
+    finally:
+        camera_client.close()
+
+    for probe in probes:
+        probe["decoded"] = probe["id"] in seen
+
+    return probes
+
+
+def fit_logistic(x, y, iterations=50, ridge=1e-3):
+    """Fit P(success) = 1 / (1 + exp(-(a + b * x))) by Newton's method"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    mean, std = x.mean(), x.std() or 1.0
+    features = np.stack([np.ones_like(x), (x - mean) / std], axis=1)
+
+    weights = np.zeros(2)
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-features @ weights))
+        gradient = features.T @ (y - p) - ridge * weights
+        hessian = features.T @ (features * (p * (1 - p))[:, None]) + ridge * np.eye(2)
+        weights += np.linalg.solve(hessian, gradient)
+
+    a = weights[0] - weights[1] * mean / std
+    b = weights[1] / std
+
+    return float(a), float(b)
+
+
+def predict(fit, modules):
+    a, b = fit
+    return 1.0 / (1.0 + np.exp(-(a + b * modules)))
+
+
+def tune(probes, target=0.9):
+    """Pick the PACKET_SIZE and ERROR_CORRECTION with the best expected payload per page"""
+    fits = {}
+    best = None
+    # Weakest level first, so on equal scores the weaker one is kept
+    for ec in [ec for ec in EC_LEVELS if any(probe["ec"] == ec for probe in probes)]:
+        results = [probe for probe in probes if probe["ec"] == ec]
+        fits[ec] = fit_logistic([p["modules"] for p in results], [p["decoded"] for p in results])
+
+        for size in sorted({probe["size"] for probe in results}):
+            modules = max(p["modules"] for p in results if p["size"] == size)
+            success = predict(fits[ec], modules)
+            if success < target:
+                continue
+            # Every failed page costs another airplane, so payload per page
+            # sent is the data carried times the chance it gets through
+            score = (size - HEADER_SIZE) * success
+            if best is None or score > best["score"]:
+                best = {"PACKET_SIZE": size, "ERROR_CORRECTION": ec, "success": float(success), "score": float(score)}
+
+    return fits, best
+
+
+def window_for(rtt, pages_per_minute, num_seqs=256):
+    """Enough packets in flight to keep the printer busy for a round trip"""
+    return max(1, min(num_seqs - 2, int(np.ceil(rtt / 60 * pages_per_minute))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate packet size, window and error correction")
+    parser.add_argument("--simulate", action="store_true", help="Run the probe set through a simulated capture")
+    parser.add_argument("--print", action="store_true", help="Print the probe set on the real printer")
+    parser.add_argument("--scan", type=float, metavar="SECONDS", help="Scan printed probes for this long, then fit")
+    parser.add_argument("--sizes", default=",".join(map(str, PROBE_SIZES)), help="Comma-separated packet sizes")
+    parser.add_argument("--levels", default="L,M,Q,H", help="Comma-separated error-correction levels")
+    parser.add_argument("--repeats", type=int, default=3, help="Probes per size and level")
+    parser.add_argument("--target", type=float, default=0.9, help="Minimum predicted decode success")
+    parser.add_argument("--rtt", type=float, help="Round-trip time in seconds, to size the window")
+    parser.add_argument("--pages-per-minute", type=float, help="Printer speed, to size the window")
+    parser.add_argument("--blur", type=float, default=1.0, help="Blur sigma of the simulated capture")
+    parser.add_argument("--noise", type=float, default=10.0, help="Noise of the simulated capture")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the simulated capture")
+    parser.add_argument("--camera-port", type=int, default=5000, help="CameraServer port for --scan")
+    parser.add_argument("--profile", default=str(PROFILE_FILE), help="Where to write the tuned profile")
+
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    levels = args.levels.split(",")
+    probes = probe_set(sizes, levels, args.repeats)
+
+    if args.print:
+        printing_dir = PROJECT_ROOT / "data" / "transport" / "printing"
+        print_probes(probes, printing_dir)
+        print(f"{len(probes)} probes sent to {printing_dir}, throw them and run --scan")
+        return
+
+    if args.scan:
+        probes = scan_probes(args.scan, args.camera_port)
+    elif args.simulate:
+        probes = run_simulated(probes, (1280, 720), args.blur, args.noise, args.seed)
+    else:
+        parser.error("one of --simulate, --print or --scan is required")
+
+    fits, best = tune(probes, args.target)
+    for ec, (a, b) in fits.items():
+        print(f"{ec}: P(decode) = 1 / (1 + exp(-({a:.3f} + {b:.4f} * modules)))")
+        for size in sizes:
+            results = [p for p in probes if p["ec"] == ec and p["size"] == size]
+            if not results:
+                continue
+            rate = sum(p["decoded"] for p in results) / len(results)
+            print(f"   {size:>5} bytes, {results[0]['modules']:>3} modules: {rate:.2f} decoded")
+
+    if best is None:
+        print(f"No setting reaches {args.target:.0%} decode success, profile not written")
+        return
+
+    profile = {"PACKET_SIZE": best["PACKET_SIZE"], "ERROR_CORRECTION": best["ERROR_CORRECTION"]}
+    if args.rtt and args.pages_per_minute:
+        profile["N"] = window_for(args.rtt, args.pages_per_minute)
+
+    Path(args.profile).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.profile, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Predicted decode success {best['success']:.2f}, profile written to {args.profile}: {profile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Renders QR codes for the printer, alone or several to a page.
+
+Monochrome codes are reduced to their module matrix and drawn back at a
+whole number of device pixels per module in 1-bit, so every module edge
+lands on a printer dot. In a batch that is the smallest scale of at least
+the minimum module size, and codes are packed onto pages in shelves,
+tallest first; a code alone on a page gets the largest scale that fits.
+Colour codes and other images are resampled to fit the page.
+"""
+import math
+
+from PIL import Image, ImageChops
+
+FINDER_MODULES = 7  # Width of the dark top row of a finder pattern
+
+
+def module_size(image):
+    """Pixels per module of a monochrome QR image, from its top-left finder
+    pattern, or None if the image does not look like one"""
+    gray = image.convert('L')
+    dark = gray.point(lambda value: 255 if value < 128 else 0)
+    bbox = dark.getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, _ = bbox
+    row = dark.crop((left, top, right, top + 1)).getdata()
+    run = 0
+    for value in row:
+        if not value:
+            break
+        run += 1
+
+    box = run / FINDER_MODULES
+    if box < 1 or left % round(box) or abs(box - round(box)) > 0.05:
+        return None
+    return round(box)
+
+
+def is_monochrome(image):
+    if image.mode in ('1', 'L'):
+        return True
+    red, green, blue = image.convert('RGB').split()
+    return ImageChops.difference(red, green).getbbox() is None and ImageChops.difference(green, blue).getbbox() is None
+
+
+def qr_matrix(image):
+    """A monochrome QR image as a 1-bit image of one pixel per module, quiet
+    zone included, or None for colour codes and other images"""
+    if not is_monochrome(image):
+        return None
+    box = module_size(image)
+    if box is None:
+        return None
+
+    # Nearest-neighbour samples the middle of each module
+    modules = image.size[0] // box
+    matrix = image.convert('L').resize((modules, modules), Image.Resampling.NEAREST)
+    return matrix.point(lambda value: 255 if value >= 128 else 0, mode='1')
+
+
+def render_matrix(matrix, module_pixels):
+    """Draw every module as a module_pixels square block of device pixels"""
+    side = matrix.size[0] * module_pixels
+    return matrix.resize((side, side), Image.Resampling.NEAREST)
+
+
+def largest_module(matrix, page_size):
+    """Most whole device pixels per module that still fit the code on the page"""
+    return max(1, min(page_size) // matrix.size[0])
+
+
+def fit_to_page(image, page_size, resample=Image.Resampling.LANCZOS):
+    """Scale an image to fill the page, keeping its aspect ratio"""
+    page_width, page_height = page_size
+    image_aspect = image.size[0] / image.size[1]
+
+    if image_aspect > page_width / page_height:
+        width, height = page_width, int(page_width / image_aspect)
+    else:
+        width, height = int(page_height * image_aspect), page_height
+
+    return image.resize((width, height), resample)
+
+
+def layout_pages(images, page_size, module_pixels):
+    """Pages holding the given QR images with modules of module_pixels each.
+
+    Colour codes, images that are not QR codes and codes too big for a page at
+    that module size are printed one per page, scaled to fit.
+    """
+    page_width, page_height = page_size
+    singles = []
+    scaled = []
+
+    for image in images:
+        matrix = qr_matrix(image)
+        if matrix is None:
+            singles.append(fit_to_page(image.convert('RGB'), page_size))
+            continue
+
+        if matrix.size[0] * module_pixels > min(page_size):
+            print(f"QR code of {matrix.size[0]} modules does not fit a page at {module_pixels} px per module")
+            singles.append(render_matrix(matrix, largest_module(matrix, page_size)))
+            continue
+
+        scaled.append((matrix, render_matrix(matrix, module_pixels)))
+
+    scaled.sort(key=lambda item: item[1].size[1], reverse=True)
+
+    pages = []  # [page image, matrices on it]
+    x = y = shelf = 0
+    for matrix, code in scaled:
+        width, height = code.size
+        if pages and x + width > page_width:
+            x, y, shelf = 0, y + shelf, 0
+        if not pages or y + height > page_height:
+            pages.append([Image.new('1', page_size, 1), []])
+            x = y = shelf = 0
+
+        pages[-1][0].paste(code, (x, y))
+        pages[-1][1].append(matrix)
+        x += width
+        shelf = max(shelf, height)
+
+    laid_out = []
+    for page, matrices in pages:
+        if len(matrices) == 1:
+            page = render_matrix(matrices[0], largest_module(matrices[0], page_size))
+        laid_out.append(page)
+
+    return laid_out + singles
+
+
+def module_pixels(min_module_mm, dpi):
+    """Smallest whole number of device pixels that is at least min_module_mm"""
+    return max(1, math.ceil(min_module_mm / 25.4 * dpi))
@@ -0,0 +1,194 @@
+"""Print backends for ImagePrinter.
+
+A backend takes a job of page images, each already scaled to the page at the
+backend's DPI, and gets it onto paper: through the Win32 spooler, through
+CUPS with lp or lpr, or into a directory of PDF/PNG files that stands in for
+a printer in tests and benchmarks. The Win32 backend asks the printer for its
+resolution and printable area; the others are told their DPI.
+"""
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PAGE_SIZE = (8.5, 11)  # Letter, in inches
+DEFAULT_DPI = 300
+
+# GetDeviceCaps indices, from wingdi.h
+HORZRES = 8
+VERTRES = 10
+LOGPIXELSX = 88
+
+
+class PrintBackend:
+    name = None
+    dpi = DEFAULT_DPI
+    printer_name = None
+
+    def page_pixels(self):
+        return int(PAGE_SIZE[0] * self.dpi), int(PAGE_SIZE[1] * self.dpi)
+
+    def print_pages(self, pages, title):
+        """Print PIL images as the pages of a single job"""
+        raise NotImplementedError
+
+    def list_printers(self):
+        return []
+
+
+class Win32Backend(PrintBackend):
+    name = 'win32'
+
+    def __init__(self, printer_name=None):
+        import win32print
+        import win32ui
+        from PIL import ImageWin
+
+        self.win32print = win32print
+        self.win32ui = win32ui
+        self.ImageWin = ImageWin
+        self.printer_name = printer_name or win32print.GetDefaultPrinter()
+        self.caps = None
+
+    def device_caps(self):
+        """(dpi, printable width, printable height) in device pixels, read
+        from the printer DC; printer_name may change after construction"""
+        if self.caps is None or self.caps[0] != self.printer_name:
+            hdc = self.win32ui.CreateDC()
+            hdc.CreatePrinterDC(self.printer_name)
+            caps = tuple(hdc.GetDeviceCaps(index) for index in (LOGPIXELSX, HORZRES, VERTRES))
+            hdc.DeleteDC()
+            self.caps = (self.printer_name, caps)
+
+        return self.caps[1]
+
+    @property
+    def dpi(self):
+        return self.device_caps()[0]
+
+    def page_pixels(self):
+        return self.device_caps()[1:]
+
+    def print_pages(self, pages, title):
+        # Open printer
+        hprinter = self.win32print.OpenPrinter(self.printer_name)
+
+        # Create DC for printer
+        hdc = self.win32ui.CreateDC()
+        hdc.CreatePrinterDC(self.printer_name)
+
+        hdc.StartDoc(title)
+        for page in pages:
+            hdc.StartPage()
+            if page.mode not in ('RGB', 'L', '1'):
+                page = page.convert('RGB')
+            dib = self.ImageWin.Dib(page)
+            dib.draw(hdc.GetHandleOutput(), (0, 0, page.size[0], page.size[1]))
+            hdc.EndPage()
+        hdc.EndDoc()
+
+        # Clean up
+        hdc.DeleteDC()
+        self.win32print.ClosePrinter(hprinter)
+
+    def list_printers(self):
+        return [printer[2] for printer in self.win32print.EnumPrinters(2)]
+
+
+class CupsBackend(PrintBackend):
+    """Submits each job as one PDF through lp, or lpr where lp is missing"""
+    name = 'cups'
+
+    def __init__(self, printer_name=None, dpi=DEFAULT_DPI):
+        self.printer_name = printer_name
+        self.dpi = dpi
+        self.command = shutil.which('lp') or shutil.which('lpr')
+        if self.command is None:
+            raise RuntimeError("Neither lp nor lpr found, is CUPS installed?")
+
+    def print_pages(self, pages, title):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'job.pdf'
+            save_pdf(pages, path, self.dpi)
+
+            if Path(self.command).name == 'lp':
+                args = [self.command, '-t', title] + (['-d', self.printer_name] if self.printer_name else [])
+            else:
+                args = [self.command, '-T', title] + (['-P', self.printer_name] if self.printer_name else [])
+            subprocess.run(args + [str(path)], check=True, capture_output=True)
+
+    def list_printers(self):
+        if not shutil.which('lpstat'):
+            return []
+        output = subprocess.run(['lpstat', '-e'], capture_output=True, text=True).stdout
+        return output.split()
+
+
+class SinkBackend(PrintBackend):
+    """Writes jobs to a directory instead of paper and records how long each
+    took in timings.jsonl. pages_per_minute and job_setup (seconds) make it
+    take as long as a real printer would."""
+    name = 'sink'
+
+    def __init__(self, directory='printed', output_format='pdf', pages_per_minute=0, job_setup=0.0, dpi=DEFAULT_DPI):
+        self.dpi = dpi
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.output_format = output_format
+        self.pages_per_minute = pages_per_minute
+        self.job_setup = job_setup
+        self.jobs = 0
+
+    def print_pages(self, pages, title):
+        started = time.time()
+        self.jobs += 1
+        stem = f"{self.jobs:06d}_{Path(title).stem}"
+
+        if self.output_format == 'pdf':
+            save_pdf(pages, self.directory / f"{stem}.pdf", self.dpi)
+        else:
+            for number, page in enumerate(pages):
+                page.save(self.directory / f"{stem}_{number}.png", dpi=(self.dpi, self.dpi))
+        written = time.time()
+
+        # Hold the job for as long as the printer we stand in for would
+        delay = self.job_setup + (60 * len(pages) / self.pages_per_minute if self.pages_per_minute else 0)
+        time.sleep(max(0.0, delay - (written - started)))
+        finished = time.time()
+
+        with open(self.directory / 'timings.jsonl', 'a') as f:
+            f.write(json.dumps({
+                'job': stem,
+                'pages': len(pages),
+                'started': started,
+                'write_seconds': written - started,
+                'job_seconds': finished - started,
+            }) + '\n')
+
+    def list_printers(self):
+        return [str(self.directory)]
+
+
+def save_pdf(pages, path, dpi):
+    pages = [page.convert('RGB') if page.mode not in ('RGB', 'L', '1') else page for page in pages]
+    pages[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=pages[1:])
+
+
+BACKENDS = {backend.name: backend for backend in (Win32Backend, CupsBackend, SinkBackend)}
+
+
+def default_backend():
+    return 'win32' if sys.platform == 'win32' else 'cups'
+
+
+def make_backend(name=None, printer_name=None, sink_dir='printed', dpi=DEFAULT_DPI, **sink_options):
+    """dpi is ignored by the win32 backend, which asks the printer"""
+    name = name or default_backend()
+    if name == 'sink':
+        return SinkBackend(sink_dir, dpi=dpi, **sink_options)
+    if name == 'win32':
+        return Win32Backend(printer_name)
+    return BACKENDS[name](printer_name, dpi)
@@ -0,0 +1,76 @@
+"""Pages waiting for the printer, most urgent first.
+
+A page is either the path of an image file or a Page handed over in memory.
+Pages come out by priority (see transport.print_handoff) and in arrival order
+within a priority. Putting a page whose supersede key is already queued drops
+the older page, so a burst of cumulative ACKs prints as one page and a
+retransmitted packet does not also print its stale queued copy.
+"""
+import heapq
+import itertools
+import os
+from collections import namedtuple
+from threading import Condition
+
+from transport.print_handoff import PRIORITY_DATA
+
+Page = namedtuple('Page', ['name', 'image'])
+
+
+def page_name(page):
+    return page.name if isinstance(page, Page) else os.path.basename(page)
+
+
+class PrintQueue:
+    def __init__(self):
+        self.heap = []  # [priority, arrival, page or None once superseded, supersede key]
+        self.arrivals = itertools.count()
+        self.queued = {}  # Supersede key -> its live entry
+        self.live = 0
+        self.superseded = 0
+        self.ready = Condition()
+
+    def __len__(self):
+        return self.live
+
+    def put(self, page, priority=PRIORITY_DATA, supersede=None):
+        with self.ready:
+            entry = [priority, next(self.arrivals), page, supersede]
+            if supersede is not None:
+                old = self.queued.get(supersede)
+                if old is not None:
+                    print(f"{page_name(old[2])} superseded by {page_name(page)}")
+                    old[2] = None
+                    self.live -= 1
+                    self.superseded += 1
+                self.queued[supersede] = entry
+
+            heapq.heappush(self.heap, entry)
+            self.live += 1
+            self.ready.notify()
+
+    def _pop(self):
+        while self.heap:
+            _, _, page, supersede = heapq.heappop(self.heap)
+            if page is None:
+                continue
+            if supersede is not None:
+                del self.queued[supersede]
+            self.live -= 1
+            return page
+        return None
+
+    def get(self, timeout=None):
+        """Most urgent page, waiting up to timeout for one; None if none came"""
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.live > 0, timeout):
+                return None
+            return self._pop()
+
+    def get_all(self):
+        """Every queued page, most urgent first"""
+        with self.ready:
+            pages = []
+            while self.live:
+                pages.append(self._pop())
+            return pages
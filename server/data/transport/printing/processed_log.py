@@ -0,0 +1,69 @@
+"""Names of the files the printer has printed, so a repeated file system
+event does not print a page twice.
+
+Each printed name is appended to the log as one line instead of rewriting
+the whole set. On startup and every COMPACT_EVERY names the log is rewritten
+with only the names whose files are still in the watched folder; a file that
+is gone can only come back as a new page.
+"""
+import json
+import os
+from pathlib import Path
+
+# Where the printer kept the whole set before, read once and then removed
+LEGACY_FILE = 'processed_files.json'
+
+
+class ProcessedLog:
+    COMPACT_EVERY = 1000
+
+    def __init__(self, path='processed_files.log', folder='.'):
+        self.path = Path(path)
+        self.folder = Path(folder)
+        self.names = set()
+        self.appended = 0
+
+        legacy = self.path.with_name(LEGACY_FILE)
+        if legacy.exists():
+            with open(legacy) as f:
+                self.names.update(json.load(f))
+        if self.path.exists():
+            with open(self.path) as f:
+                self.names.update(line.rstrip('\n') for line in f)
+
+        self.file = None
+        self.compact()
+        legacy.unlink(missing_ok=True)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names):
+        new = [name for name in names if name not in self.names]
+        self.names.update(new)
+        self.file.write(''.join(f"{name}\n" for name in new))
+        self.file.flush()
+
+        self.appended += len(new)
+        if self.appended >= self.COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only the names whose files still exist"""
+        self.names = {name for name in self.names if (self.folder / name).exists()}
+
+        partial = self.path.with_name(self.path.name + '.part')
+        with open(partial, 'w') as f:
+            f.writelines(f"{name}\n" for name in sorted(self.names))
+
+        if self.file is not None:
+            self.file.close()
+        os.replace(partial, self.path)
+        self.file = open(self.path, 'a')
+        self.appended = 0
+
+    def close(self):
+        self.file.close()
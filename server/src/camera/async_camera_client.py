@@ -0,0 +1,341 @@
+"""Asyncio CameraClient that reads the next frame while the current one is decoded.
+
+A background reader task receives frames into a few reusable buffers and
+keeps one ready ahead of the consumer, so socket time and decode time
+overlap instead of taking turns. In mode 'latest' the next frame is only
+requested when the consumer takes one, and a frame that waited through a
+consumer pause is replaced by a fresh one. When CameraServer goes away the reader
+reconnects with exponential backoff and the consumer simply waits.
+
+    async with AsyncCameraClient(port=5000) as client:
+        async for frame in client:
+            codes = await asyncio.to_thread(decode, frame)
+
+PrefetchingCameraClient runs one on a background event loop for the
+threaded Sender, Receiver and Connection.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import socket
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.frame_protocol import (
+    HEADER, PAYLOAD, PAYLOADS_HEADER, REQUEST, Payload, ProtocolError, pack_subscribe, unpack_header,
+    unpack_payloads_header
+)
+from camera.camera_client import CameraClient
+
+
+class AsyncCameraClient:
+    # One frame with the consumer, one ready for it, one being received
+    BUFFERS = 3
+    # Decoded frames buffered in payload mode; payloads are never dropped here
+    PAYLOAD_BACKLOG = 64
+    RECONNECT_MIN = 0.5
+    RECONNECT_MAX = 10.0
+    # A prefetched frame that has waited longer than this for the consumer is
+    # dropped in mode 'latest' and a fresh one fetched instead
+    STALE_AFTER = 0.5
+
+    def __init__(self, host='localhost', port=5000, mode='latest', queue_depth=1, camera=0):
+        """Same modes as CameraClient. In mode 'latest' at most one request is
+        outstanding, sent when the previous frame is handed out, so a frame is
+        at most one decode old, or fresh after a pause of over STALE_AFTER."""
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.queue_depth = queue_depth
+        self.camera = camera
+
+        self.sock = None
+        self.reader = None
+        self.ready = None
+        self.wanted = None  # Set when mode 'latest' may request the next frame
+        self.buffers = [bytearray() for _ in range(self.BUFFERS)]
+        self.header = bytearray(max(HEADER.size, PAYLOADS_HEADER.size))
+
+        # Capture sequence number and timestamp of the last frame returned,
+        # how many captured frames this client never saw, and how often the
+        # connection was lost
+        self.frame_seq = 0
+        self.frame_timestamp = 0.0
+        self.skipped_frames = 0
+        self.reconnects = 0
+
+    async def start(self):
+        self.ready = asyncio.Queue(maxsize=self.PAYLOAD_BACKLOG if self.mode == 'payloads' else 1)
+        self.wanted = asyncio.Event()
+        self.wanted.set()
+        self.reader = asyncio.create_task(self.read_loop())
+
+    async def connect(self):
+        """Connect and subscribe, retrying with backoff until CameraServer is up"""
+        loop = asyncio.get_running_loop()
+        delay = self.RECONNECT_MIN
+        while True:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, (self.host, self.port))
+                await loop.sock_sendall(sock, pack_subscribe(self.mode, self.queue_depth, self.camera))
+                self.sock = sock
+                return
+            except OSError as e:
+                sock.close()
+                print(f"CameraServer at {self.host}:{self.port} unavailable ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, self.RECONNECT_MAX)
+
+    async def _recv_into(self, view):
+        loop = asyncio.get_running_loop()
+        while len(view):
+            received = await loop.sock_recv_into(self.sock, view)
+            if received == 0:
+                raise ConnectionError("CameraServer closed the connection")
+            view = view[received:]
+
+    async def read_frame(self, index):
+        if self.mode == 'latest':
+            await asyncio.get_running_loop().sock_sendall(self.sock, REQUEST)
+
+        await self._recv_into(memoryview(self.header)[:HEADER.size])
+        dtype, shape, length, seq, timestamp = unpack_header(self.header[:HEADER.size])
+
+        # Replace rather than resize; the consumer may still hold a view
+        if len(self.buffers[index]) < length:
+            self.buffers[index] = bytearray(length)
+        await self._recv_into(memoryview(self.buffers[index])[:length])
+
+        frame = np.frombuffer(self.buffers[index], dtype=dtype, count=length // dtype.itemsize).reshape(shape)
+        return seq, timestamp, frame, time.time()
+
+    async def read_payloads(self):
+        await self._recv_into(memoryview(self.header)[:PAYLOADS_HEADER.size])
+        seq, timestamp, count = unpack_payloads_header(self.header[:PAYLOADS_HEADER.size])
+
+        payloads = []
+        record = bytearray(PAYLOAD.size)
+        for _ in range(count):
+            await self._recv_into(memoryview(record))
+            camera, left, top, width, height, length = PAYLOAD.unpack(record)
+            data = bytearray(length)
+            await self._recv_into(memoryview(data))
+            payloads.append(Payload(bytes(data), camera, (left, top, width, height), seq, timestamp))
+
+        return seq, timestamp, payloads
+
+    async def read_loop(self):
+        index = 0
+        while True:
+            await self.connect()
+            try:
+                while True:
+                    if self.mode == 'payloads':
+                        item = await self.read_payloads()
+                    else:
+                        if self.mode == 'latest':
+                            await self.wanted.wait()
+                            self.wanted.clear()
+                        item = await self.read_frame(index)
+                        index = (index + 1) % self.BUFFERS
+                    await self.ready.put(item)
+            except (OSError, ProtocolError) as e:
+                print(f"Lost CameraServer ({e}), reconnecting")
+                self.sock.close()
+                self.sock = None
+                self.reconnects += 1
+                # The restarted server numbers its frames from one again
+                self.frame_seq = 0
+                # A request lost with the connection has to be sent again
+                if self.ready.empty():
+                    self.wanted.set()
+
+    def _track(self, seq, timestamp):
+        if self.frame_seq and seq > self.frame_seq + 1:
+            self.skipped_frames += seq - self.frame_seq - 1
+        self.frame_seq = seq
+        self.frame_timestamp = timestamp
+
+    def frame_age(self):
+        """Seconds since the last returned frame was captured"""
+        return time.time() - self.frame_timestamp
+
+    async def get_frame(self):
+        """Return the next frame, a view that stays valid until the next call"""
+        seq, timestamp, frame, received = await self.ready.get()
+        if self.mode == 'latest':
+            self.wanted.set()
+            if time.time() - received > self.STALE_AFTER:
+                # The consumer paused; the frame requested just now is current
+                seq, timestamp, frame, received = await self.ready.get()
+                self.wanted.set()
+        self._track(seq, timestamp)
+        return frame
+
+    async def get_payloads(self):
+        """Return the new Payloads from the server's next decoded frame; only for mode 'payloads'"""
+        seq, timestamp, payloads = await self.ready.get()
+        self._track(seq, timestamp)
+        return payloads
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await (self.get_payloads() if self.mode == 'payloads' else self.get_frame())
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+        if self.sock is not None:
+            self.sock.close()
+
+
+class PrefetchingCameraClient:
+    """Blocking interface to an AsyncCameraClient on its own event loop thread.
+
+    get_frame and get_payloads return None if nothing arrives within
+    `timeout`, so callers keep running their timers while CameraServer is
+    being restarted.
+
+    backend 'shm' reads frames from the ring of a CameraServer on this host
+    started with --shm instead, through a CameraClient; there is nothing to
+    prefetch then, and frames older than STALE_AFTER are skipped as in mode
+    'latest'. The ring is attached again when no frame has come for
+    REATTACH_AFTER seconds, since a restarted server makes a new one.
+    """
+
+    REATTACH_AFTER = 1.0
+
+    def __init__(self, backend='tcp', **kwargs):
+        self.backend = backend
+        if backend == 'shm':
+            if kwargs.get('mode', 'latest') != 'latest':
+                raise ValueError("The shm backend only has mode 'latest'")
+            self.ring_args = {key: kwargs[key] for key in ('port', 'camera') if key in kwargs}
+            self.ring_client = None
+            self.frame_timestamp = 0.0
+            return
+
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
+        self.client = AsyncCameraClient(**kwargs)
+        self.call(self.client.start())
+
+    def call(self, coroutine, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Cancelling a wait on the queue leaves the item for the next call
+            future.cancel()
+            return None
+
+    def _get_ring_frame(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self.REATTACH_AFTER
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return None
+
+            if self.ring_client is None:
+                try:
+                    self.ring_client = CameraClient(backend='shm', **self.ring_args)
+                except FileNotFoundError:
+                    time.sleep(wait)  # Server not started yet
+                    continue
+
+            try:
+                frame = self.ring_client.get_frame(timeout=wait)
+            except TimeoutError:
+                self.ring_client.close()
+                self.ring_client = None
+                continue
+
+            # Like a stale prefetched frame, the newest frame in the ring may
+            # be from before a pause; a newly attached ring also starts with
+            # one we may already have had
+            timestamp = self.ring_client.frame_timestamp
+            if timestamp > self.frame_timestamp and time.time() - timestamp <= AsyncCameraClient.STALE_AFTER:
+                self.frame_timestamp = self.ring_client.frame_timestamp
+                return frame
+
+    def get_frame(self, timeout=None):
+        if self.backend == 'shm':
+            return self._get_ring_frame(timeout)
+        return self.call(self.client.get_frame(), timeout)
+
+    def get_payloads(self, timeout=None):
+        return self.call(self.client.get_payloads(), timeout)
+
+    def frame_age(self):
+        if self.backend == 'shm':
+            return time.time() - self.frame_timestamp
+        return self.client.frame_age()
+
+    def close(self):
+        if self.backend == 'shm':
+            if self.ring_client is not None:
+                self.ring_client.close()
+            return
+
+        self.call(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def benchmark(port, frames, decode_time):
+    """Frames per second of a consumer spending decode_time on each frame,
+    reading with CameraClient and with AsyncCameraClient"""
+    client = CameraClient(port=port)
+    client.get_frame()
+    start = time.time()
+    for _ in range(frames):
+        client.get_frame()
+        time.sleep(decode_time)
+    blocking = frames / (time.time() - start)
+    client.close()
+
+    async with AsyncCameraClient(port=port) as client:
+        await client.get_frame()
+        start = time.time()
+        for _ in range(frames):
+            await client.get_frame()
+            await asyncio.to_thread(time.sleep, decode_time)
+        prefetching = frames / (time.time() - start)
+
+    return blocking, prefetching
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare blocking and prefetching camera clients')
+    parser.add_argument('--port', type=int, default=5000, help='CameraServer port')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to read with each client')
+    parser.add_argument('--decode-time', type=float, default=0.02, help='Seconds of work per frame')
+
+    args = parser.parse_args()
+    blocking, prefetching = asyncio.run(benchmark(args.port, args.frames, args.decode_time))
+    print(f"CameraClient: {blocking:.1f} frames/s, AsyncCameraClient: {prefetching:.1f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
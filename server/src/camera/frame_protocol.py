@@ -0,0 +1,126 @@
+"""Wire format for frames between CameraServer and CameraClient.
+
+Each frame is a fixed-width little-endian header followed by the raw pixel
+bytes of a C-contiguous ndarray, so neither side has to pickle anything. The
+header carries the capture sequence number and timestamp, so a consumer can
+tell skipped frames and how old a frame is.
+
+On connecting, a client sends one SUBSCRIBE message choosing how frames are
+delivered. In MODE_LATEST the server sends nothing until the client writes a
+REQUEST byte, then sends the newest frame; in MODE_QUEUE it pushes every
+frame but keeps at most `depth` unsent ones per client, dropping the oldest.
+Frame subscriptions pick one of the server's cameras. In MODE_PAYLOADS the
+server decodes the QR codes of all its cameras itself and pushes, for every
+frame it decodes, a PAYLOADS header followed by one PAYLOAD record and the
+payload bytes per code found. Codes another camera reported a moment ago are
+left out, so the stream is the merged view of all cameras.
+"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC = b"FRM2"
+
+# magic, dtype code, ndim, height, width, channels, sequence number,
+# capture timestamp, payload length
+HEADER = struct.Struct("<4sBBIIIQdQ")
+
+SUBSCRIBE_MAGIC = b"SUB2"
+
+# magic, delivery mode, queue depth, camera index
+SUBSCRIBE = struct.Struct("<4sBIB")
+
+MODE_LATEST = 0
+MODE_QUEUE = 1
+MODE_PAYLOADS = 2
+MODES = {"latest": MODE_LATEST, "queue": MODE_QUEUE, "payloads": MODE_PAYLOADS}
+
+REQUEST = b"\x01"
+
+PAYLOADS_MAGIC = b"PAY2"
+
+# magic, message sequence number, capture timestamp, number of payloads
+PAYLOADS_HEADER = struct.Struct("<4sQdI")
+
+# camera index, left, top, width, height of the code in its frame, payload length
+PAYLOAD = struct.Struct("<BiiiiI")
+
+# A QR payload decoded by the server, where it was seen and when
+Payload = namedtuple("Payload", ["data", "camera", "rect", "seq", "timestamp"])
+
+DTYPES = {
+    0: np.dtype(np.uint8),
+    1: np.dtype(np.uint16),
+    2: np.dtype(np.float32),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def pack_header(frame, seq=0, timestamp=0.0):
+    """Header for a frame; the frame itself must be C-contiguous"""
+    if frame.dtype not in DTYPE_CODES:
+        raise ProtocolError(f"Unsupported frame dtype {frame.dtype}")
+    if frame.ndim not in (2, 3):
+        raise ProtocolError(f"Unsupported frame shape {frame.shape}")
+
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+
+    return HEADER.pack(
+        MAGIC, DTYPE_CODES[frame.dtype], frame.ndim, height, width, channels, seq, timestamp, frame.nbytes
+    )
+
+
+def unpack_header(data):
+    """Return (dtype, shape, payload length, sequence number, timestamp) from a packed header"""
+    magic, dtype_code, ndim, height, width, channels, seq, timestamp, length = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame header magic {magic!r}")
+    if dtype_code not in DTYPES:
+        raise ProtocolError(f"Unknown dtype code {dtype_code}")
+
+    dtype = DTYPES[dtype_code]
+    shape = (height, width, channels) if ndim == 3 else (height, width)
+    if length != dtype.itemsize * int(np.prod(shape)):
+        raise ProtocolError(f"Frame length {length} does not match shape {shape}")
+
+    return dtype, shape, length, seq, timestamp
+
+
+def pack_subscribe(mode, depth=1, camera=0):
+    return SUBSCRIBE.pack(SUBSCRIBE_MAGIC, MODES[mode], depth, camera)
+
+
+def unpack_subscribe(data):
+    """Return (mode code, queue depth, camera index) from a packed SUBSCRIBE message"""
+    magic, mode, depth, camera = SUBSCRIBE.unpack(data)
+    if magic != SUBSCRIBE_MAGIC:
+        raise ProtocolError(f"Bad subscribe magic {magic!r}")
+    if mode not in MODES.values():
+        raise ProtocolError(f"Unknown delivery mode {mode}")
+
+    return mode, max(1, depth), camera
+
+
+def pack_payloads(seq, timestamp, codes):
+    """Message for the (camera, data, (left, top, width, height)) codes found in one frame"""
+    parts = [PAYLOADS_HEADER.pack(PAYLOADS_MAGIC, seq, timestamp, len(codes))]
+    for camera, data, rect in codes:
+        parts.append(PAYLOAD.pack(camera, *rect, len(data)))
+        parts.append(data)
+
+    return b"".join(parts)
+
+
+def unpack_payloads_header(data):
+    """Return (sequence number, timestamp, number of payloads) from a packed header"""
+    magic, seq, timestamp, count = PAYLOADS_HEADER.unpack(data)
+    if magic != PAYLOADS_MAGIC:
+        raise ProtocolError(f"Bad payloads header magic {magic!r}")
+
+    return seq, timestamp, count
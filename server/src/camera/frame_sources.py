@@ -0,0 +1,241 @@
+"""Frame sources CameraServer can capture from besides a live camera.
+
+Every source has the parts of the cv2.VideoCapture interface that
+CameraServer uses (isOpened, read, get, set, release), so recorded scans can
+be replayed offline and give the same frames on every run. Recorded sources
+play back at `speed` times real time: 1 for real time, 4 for four times as
+fast, 0 for as fast as frames can be read.
+
+FrameRecorder saves a live session as an image directory that
+ImageDirectorySource replays with the original timing.
+"""
+import csv
+import queue
+import struct
+import time
+from pathlib import Path
+from threading import Thread
+
+import cv2
+import numpy as np
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Capture times of a recorded session, one "file,timestamp" row per frame
+TIMESTAMPS_FILE = "frames.csv"
+
+
+class PacedSource:
+    """Sleeps between frames so they come out at `speed` times their own pace"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.start = None  # (wall time, source time) of the first frame
+
+    def pace(self, source_time):
+        if self.speed <= 0:
+            return
+        if self.start is None:
+            self.start = (time.time(), source_time)
+            return
+
+        wall, first = self.start
+        delay = wall + (source_time - first) / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+
+class VideoFileSource(PacedSource):
+    def __init__(self, path, speed=1.0, loop=False):
+        super().__init__(speed)
+        self.capture = cv2.VideoCapture(str(path))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self.loop = loop
+        self.index = 0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret and self.loop and self.index > 0:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.index = 0
+            self.start = None
+            ret, frame = self.capture.read()
+
+        if ret:
+            self.pace(self.index / self.fps)
+            self.index += 1
+        return ret, frame
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirectorySource(PacedSource):
+    """Images in name order, timed by TIMESTAMPS_FILE if there is one, else at `fps`"""
+
+    def __init__(self, directory, speed=1.0, loop=False, fps=30):
+        super().__init__(speed)
+        self.directory = Path(directory)
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+
+        timestamps_file = self.directory / TIMESTAMPS_FILE
+        if timestamps_file.exists():
+            with open(timestamps_file, newline="") as f:
+                rows = [(name, float(timestamp)) for name, timestamp in csv.reader(f)]
+            self.files = [self.directory / name for name, _ in rows]
+            self.timestamps = [timestamp for _, timestamp in rows]
+        else:
+            self.files = sorted(p for p in self.directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+            self.timestamps = [index / fps for index in range(len(self.files))]
+
+        first = cv2.imread(str(self.files[0])) if self.files else None
+        self.shape = first.shape if first is not None else (0, 0)
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def read(self):
+        if self.index == len(self.files):
+            if not self.loop:
+                return False, None
+            self.index = 0
+            self.start = None
+
+        frame = cv2.imread(str(self.files[self.index]))
+        self.pace(self.timestamps[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.shape[0]
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+
+class SyntheticSource(PacedSource):
+    """Noise frames generated at `fps`, stamped with their generation time in
+    the first eight bytes so consumers can measure latency"""
+
+    def __init__(self, width=1920, height=1080, fps=30, speed=1.0):
+        super().__init__(speed)
+        self.frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        self.fps = fps
+        self.index = 0
+
+    def read(self):
+        self.pace(self.index / self.fps)
+        self.index += 1
+        frame = self.frame.copy()
+        frame.reshape(-1)[:8] = np.frombuffer(struct.pack("<d", time.time()), dtype=np.uint8)
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.frame.shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.frame.shape[0]
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+
+class FrameRecorder:
+    """Wraps a source and saves every frame it reads to an image directory.
+
+    Frames are written as PNG, which QR decoding can trust, by a background
+    thread so the capture loop does not wait on the disk. If the disk falls
+    RECORD_BACKLOG frames behind, frames are left out of the recording.
+    """
+
+    RECORD_BACKLOG = 64
+
+    def __init__(self, source, directory):
+        self.source = source
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.timestamps = open(self.directory / TIMESTAMPS_FILE, "w", newline="")
+        self.writer = csv.writer(self.timestamps)
+        self.pending = queue.Queue(maxsize=self.RECORD_BACKLOG)
+        self.index = 0
+        self.dropped = 0
+
+        self.thread = Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            name, timestamp, frame = item
+            cv2.imwrite(str(self.directory / name), frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            self.writer.writerow([name, timestamp])
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def read(self):
+        ret, frame = self.source.read()
+        if ret:
+            try:
+                self.pending.put_nowait((f"{self.index:06d}.png", time.time(), frame))
+                self.index += 1
+            except queue.Full:
+                self.dropped += 1
+        return ret, frame
+
+    def get(self, prop):
+        return self.source.get(prop)
+
+    def set(self, prop, value):
+        return self.source.set(prop, value)
+
+    def release(self):
+        self.source.release()
+        self.pending.put(None)
+        self.thread.join()
+        self.timestamps.close()
+        if self.dropped:
+            print(f"Recording in {self.directory} is missing {self.dropped} frames")
+
+
+def open_source(spec, speed=1.0, loop=False):
+    """Source for a camera index, "synthetic[:WIDTHxHEIGHT[@FPS]]", a video
+    file or an image directory"""
+    spec = str(spec)
+    if spec.isdigit():
+        return cv2.VideoCapture(int(spec))
+
+    if spec.startswith("synthetic"):
+        width, height, fps = 1920, 1080, 30
+        if ":" in spec:
+            size, _, rate = spec.split(":", 1)[1].partition("@")
+            width, height = map(int, size.split("x"))
+            fps = int(rate) if rate else fps
+        return SyntheticSource(width, height, fps, speed)
+
+    path = Path(spec)
+    if path.is_dir():
+        return ImageDirectorySource(path, speed, loop)
+    return VideoFileSource(path, speed, loop)
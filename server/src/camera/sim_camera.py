@@ -0,0 +1,258 @@
+import argparse
+import heapq
+import json
+import logging
+import random
+import signal
+import sys
+import time
+from pathlib import Path
+from threading import Lock, Thread
+
+import cv2
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.camera_server import CameraServer
+
+
+class SimulatedCamera:
+    """Stand-in for the printer, the flight and the webcam between two hosts.
+
+    Watches the peer's printing directory for new QR pages and "flies" each
+    one: pages can get lost, have modules flipped or land blurred, and arrive
+    after a random delay, possibly out of order. A landed page stays in front
+    of the camera for ``dwell`` seconds. Delays are in simulated seconds and
+    ``time_scale`` simulated seconds pass per real second.
+
+    It exposes the parts of the cv2.VideoCapture interface that CameraServer
+    uses, so it can be served to Sender and Receiver like a real camera.
+    """
+
+    def __init__(
+        self,
+        watch_dir,
+        loss=0.0,
+        bit_error=0.0,
+        blur=0.0,
+        delay=60.0,
+        jitter=30.0,
+        reorder=0.0,
+        reorder_delay=300.0,
+        dwell=5.0,
+        time_scale=1.0,
+        fps=10,
+        resolution=(1280, 720),
+        box_size=10,
+        seed=None,
+    ):
+        self.watch_dir = Path(watch_dir)
+        self.loss = loss
+        self.bit_error = bit_error
+        self.blur = blur
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.dwell = dwell
+        self.time_scale = time_scale
+        self.fps = fps
+        self.resolution = resolution
+        self.box_size = box_size
+        self.random = random.Random(seed)
+        self.np_random = np.random.default_rng(seed)
+
+        self.logger = logging.getLogger('SimulatedCamera')
+
+        width, height = self.resolution
+        self.blank = np.full((height, width, 3), 255, dtype=np.uint8)
+
+        self.seen = set(self.watch_dir.glob("*.png"))  # Pages from before we started never fly
+        self.in_flight = []  # Heap of (landing time, name, frame)
+        self.in_view = []  # (start, end, frame) for landed pages, in landing order
+        self.view_end = 0.0
+        self.lock = Lock()
+
+        self.counters = {
+            "pages_printed": 0,
+            "pages_lost": 0,
+            "pages_corrupted": 0,
+            "pages_blurred": 0,
+            "pages_landed": 0,
+        }
+        self.start_time = time.time()
+        self.opened = True
+
+        Thread(target=self.watch, daemon=True).start()
+
+    def sim_time(self):
+        return (time.time() - self.start_time) * self.time_scale
+
+    def watch(self):
+        """Poll the printing directory for pages that have just been 'printed'"""
+        while self.opened:
+            for path in sorted(self.watch_dir.glob("*.png")):
+                if path not in self.seen:
+                    self.seen.add(path)
+                    self.launch(path)
+            time.sleep(0.05)
+
+    def launch(self, path):
+        # The producer may still be writing the file
+        page = None
+        for _ in range(20):
+            page = cv2.imread(str(path))
+            if page is not None:
+                break
+            time.sleep(0.05)
+        if page is None:
+            self.logger.warning(f"Could not read {path.name}")
+            return
+
+        self.counters["pages_printed"] += 1
+        if self.random.random() < self.loss:
+            self.counters["pages_lost"] += 1
+            return
+
+        if self.bit_error > 0:
+            page = self.flip_modules(page)
+        if self.random.random() < self.blur:
+            self.counters["pages_blurred"] += 1
+            page = cv2.GaussianBlur(page, (0, 0), self.box_size)
+
+        delay = self.delay + self.random.uniform(-self.jitter, self.jitter)
+        if self.random.random() < self.reorder:
+            delay += self.reorder_delay
+
+        with self.lock:
+            heapq.heappush(self.in_flight, (self.sim_time() + max(0.0, delay), path.name, self.frame_for(page)))
+
+    def flip_modules(self, page):
+        """Flip each module independently with probability bit_error"""
+        rows, cols = page.shape[0] // self.box_size, page.shape[1] // self.box_size
+        flips = self.np_random.random((rows, cols)) < self.bit_error
+        if not flips.any():
+            return page
+
+        self.counters["pages_corrupted"] += 1
+        mask = np.repeat(np.repeat(flips, self.box_size, axis=0), self.box_size, axis=1)
+        page = page.copy()
+        region = page[: mask.shape[0], : mask.shape[1]]
+        region[mask] = 255 - region[mask]
+
+        return page
+
+    def frame_for(self, page):
+        """Place a page in the middle of a camera frame, scaled to fit"""
+        width, height = self.resolution
+        scale = min(width / page.shape[1], height / page.shape[0])
+        page = cv2.resize(page, (int(page.shape[1] * scale), int(page.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+
+        frame = self.blank.copy()
+        y = (height - page.shape[0]) // 2
+        x = (width - page.shape[1]) // 2
+        frame[y : y + page.shape[0], x : x + page.shape[1]] = page
+
+        return frame
+
+    def current_frame(self):
+        now = self.sim_time()
+        with self.lock:
+            # Landed pages are held up to the camera one after another
+            while self.in_flight and self.in_flight[0][0] <= now:
+                landing, _, frame = heapq.heappop(self.in_flight)
+                start = max(landing, self.view_end)
+                self.view_end = start + self.dwell
+                self.in_view.append((start, self.view_end, frame))
+                self.counters["pages_landed"] += 1
+
+            while self.in_view and self.in_view[0][1] <= now:
+                self.in_view.pop(0)
+
+            if self.in_view and self.in_view[0][0] <= now:
+                return self.in_view[0][2]
+
+        return self.blank
+
+    # cv2.VideoCapture interface used by CameraServer
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        time.sleep(1 / self.fps)
+        return self.opened, self.current_frame().copy()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.resolution[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.resolution[1]
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.opened = False
+
+    def stats(self):
+        return {**self.counters, "sim_seconds": self.sim_time()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated paper channel served as a camera')
+    parser.add_argument('watch', help="Peer's printing directory to take pages from")
+    parser.add_argument('--host', default='localhost', help='Host address to bind to')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability a page never arrives')
+    parser.add_argument('--bit-error', type=float, default=0.0, help='Probability each module is flipped')
+    parser.add_argument('--blur', type=float, default=0.0, help='Probability a page arrives blurred')
+    parser.add_argument('--delay', type=float, default=60.0, help='Mean flight time in simulated seconds')
+    parser.add_argument('--jitter', type=float, default=30.0, help='Flight time jitter in simulated seconds')
+    parser.add_argument('--reorder', type=float, default=0.0, help='Probability a page is held back')
+    parser.add_argument('--reorder-delay', type=float, default=300.0, help='Extra delay for held back pages')
+    parser.add_argument('--dwell', type=float, default=5.0, help='Simulated seconds a page stays in view')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Simulated seconds per real second')
+    parser.add_argument('--fps', type=int, default=10, help='Frames per real second')
+    parser.add_argument('--seed', type=int, help='Random seed')
+    parser.add_argument('--stats', help='Write channel statistics as JSON to this file on exit')
+
+    args = parser.parse_args()
+
+    camera = SimulatedCamera(
+        args.watch,
+        loss=args.loss,
+        bit_error=args.bit_error,
+        blur=args.blur,
+        delay=args.delay,
+        jitter=args.jitter,
+        reorder=args.reorder,
+        reorder_delay=args.reorder_delay,
+        dwell=args.dwell,
+        time_scale=args.time_scale,
+        fps=args.fps,
+        seed=args.seed,
+    )
+    server = CameraServer(host=args.host, port=args.port, camera=camera)
+
+    # Benchmark runners stop us with SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        server.start()
+        while True:
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if args.stats:
+            with open(args.stats, 'w') as f:
+                json.dump(camera.stats(), f, indent=2)
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
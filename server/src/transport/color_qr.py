@@ -0,0 +1,274 @@
+"""Colour-multiplexed QR codes.
+
+A packet is split across three monochrome QR layers that are printed on top
+of each other in cyan, magenta and yellow ink. Each ink absorbs one of the
+camera's colour channels (cyan absorbs red, magenta green, yellow blue), so
+the receiver can pull the layers apart again and decode them separately.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import qrcode
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+LAYERS = ("cyan", "magenta", "yellow")
+NUM_LAYERS = len(LAYERS)
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+CALIBRATION_FILE = PROJECT_ROOT / "data" / "transport" / "color_calibration.json"
+
+
+def split_payload(payload, num_layers=NUM_LAYERS):
+    """Split a payload into ``num_layers`` chunks of (almost) equal length"""
+    size = -(-len(payload) // num_layers)
+    return [payload[i * size : (i + 1) * size] for i in range(num_layers)]
+
+
+def make_layer_matrices(chunks, error_correction=qrcode.constants.ERROR_CORRECT_L, border=4):
+    """Build one QR module matrix per chunk, all at the same QR version"""
+    codes = []
+    for chunk in chunks:
+        qr = qrcode.QRCode(version=None, error_correction=error_correction, border=border)
+        qr.add_data(chunk)
+        qr.make(fit=True)
+        codes.append(qr)
+
+    # Layers have to line up module for module, so every layer uses the
+    # version that the largest chunk needed.
+    version = max(qr.version for qr in codes)
+    matrices = []
+    for chunk, qr in zip(chunks, codes):
+        if qr.version != version:
+            qr = qrcode.QRCode(version=version, error_correction=error_correction, border=border)
+            qr.add_data(chunk)
+            qr.make(fit=False)
+        matrices.append(np.array(qr.get_matrix(), dtype=bool))
+
+    return matrices
+
+
+def render_layers(matrices, box_size=10):
+    """Render the layer matrices as one RGB image printed in CMY"""
+    ink = np.stack(matrices, axis=-1)
+
+    # Ink in layer i removes RGB channel i: cyan -> R, magenta -> G, yellow -> B
+    rgb = np.where(ink, 0, 255).astype(np.uint8)
+    rgb = np.repeat(np.repeat(rgb, box_size, axis=0), box_size, axis=1)
+
+    return Image.fromarray(rgb, "RGB")
+
+
+def make_color_qr(payload, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4):
+    """Encode a payload as a colour-multiplexed QR image"""
+    matrices = make_layer_matrices(split_payload(payload), error_correction, border)
+    return render_layers(matrices, box_size)
+
+
+class ColorCalibration:
+    """Maps observed channel absorbance back to per-layer ink coverage.
+
+    Real inks are not pure: cyan also absorbs some green, magenta some blue and
+    so on. ``mixing`` holds one column per ink with the absorbance that ink
+    produces in the R, G and B channels, and separation applies its inverse.
+    """
+
+    def __init__(self, mixing=None, paper=(255.0, 255.0, 255.0)):
+        self.mixing = np.eye(NUM_LAYERS) if mixing is None else np.asarray(mixing, dtype=np.float64)
+        self.unmixing = np.linalg.inv(self.mixing)
+        self.paper = np.asarray(paper, dtype=np.float64)
+
+    @classmethod
+    def from_patches(cls, paper, cyan, magenta, yellow):
+        """Build a calibration from the mean BGR colour of each printed patch"""
+        paper_rgb = np.asarray(paper, dtype=np.float64)[::-1]
+        columns = []
+        for patch in (cyan, magenta, yellow):
+            patch_rgb = np.asarray(patch, dtype=np.float64)[::-1]
+            columns.append(1.0 - patch_rgb / paper_rgb)
+
+        return cls(np.stack(columns, axis=1), paper_rgb)
+
+    @classmethod
+    def from_target(cls, frame):
+        """Calibrate from a frame showing the target from render_calibration_target"""
+        height, width = frame.shape[:2]
+        patches = []
+        for row in range(2):
+            for col in range(2):
+                # Sample the middle half of each quadrant to stay clear of edges
+                y0, y1 = (4 * row + 1) * height // 8, (4 * row + 3) * height // 8
+                x0, x1 = (4 * col + 1) * width // 8, (4 * col + 3) * width // 8
+                patches.append(frame[y0:y1, x0:x1].reshape(-1, 3).mean(axis=0))
+
+        return cls.from_patches(*patches)
+
+    @classmethod
+    def load(cls, path=CALIBRATION_FILE):
+        """Load a saved calibration, falling back to ideal inks"""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+
+        with open(path) as f:
+            data = json.load(f)
+
+        return cls(data["mixing"], data["paper"])
+
+    def save(self, path=CALIBRATION_FILE):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"mixing": self.mixing.tolist(), "paper": self.paper.tolist()}, f, indent=2)
+
+    def separate(self, frame):
+        """Split a BGR frame into per-layer ink coverage, shape (3, h, w)"""
+        rgb = frame[..., ::-1].astype(np.float32)
+        absorbance = 1.0 - rgb / self.paper.astype(np.float32)
+        layers = absorbance @ self.unmixing.T.astype(np.float32)
+
+        return np.moveaxis(layers, -1, 0)
+
+
+def render_calibration_target(size=1200):
+    """Paper, cyan, magenta and yellow quadrants for ColorCalibration.from_target"""
+    half = size // 2
+    rgb = np.full((size, size, 3), 255, dtype=np.uint8)
+    rgb[:half, half:] = (0, 255, 255)
+    rgb[half:, :half] = (255, 0, 255)
+    rgb[half:, half:] = (255, 255, 0)
+
+    return Image.fromarray(rgb, "RGB")
+
+
+def layer_to_gray(coverage):
+    """Threshold a layer's ink coverage into a black-on-white image for pyzbar"""
+    gray = np.clip((1.0 - coverage) * 255, 0, 255).astype(np.uint8)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    return binary
+
+
+def decode_layers(frame, calibration=None):
+    """Decode each colour layer of a frame.
+
+    Returns a list with one entry per layer, either the layer's payload bytes
+    or None when that layer could not be read.
+    """
+    calibration = calibration or ColorCalibration()
+    payloads = []
+    for coverage in calibration.separate(frame):
+        qr_codes = decode(layer_to_gray(coverage))
+        payloads.append(qr_codes[0].data if qr_codes else None)
+
+    return payloads
+
+
+def decode_color_qr(frame, calibration=None):
+    """Decode a colour-multiplexed QR code, or return None if any layer is missing"""
+    payloads = decode_layers(frame, calibration)
+    if any(payload is None for payload in payloads):
+        return None
+
+    return b"".join(payloads)
+
+
+def simulate_capture(image, mixing, noise=8.0, blur=3, rng=None):
+    """Turn an ideal RGB render into a BGR 'camera frame' with ink crosstalk"""
+    rng = rng or np.random.default_rng()
+    ink = 1.0 - np.asarray(image, dtype=np.float32) / 255.0
+    absorbance = np.clip(ink @ np.asarray(mixing, dtype=np.float32).T, 0.0, 1.0)
+    rgb = 255.0 * (1.0 - absorbance) + rng.normal(0.0, noise, absorbance.shape)
+    frame = np.clip(rgb, 0, 255).astype(np.uint8)[..., ::-1]
+    if blur > 1:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+
+    return np.ascontiguousarray(frame)
+
+
+def benchmark(payload_sizes=(256, 512, 1024), crosstalk=0.25, trials=20, seed=0):
+    """Compare monochrome and colour codes on synthetic renders with crosstalk"""
+    import base64
+
+    rng = np.random.default_rng(seed)
+    mixing = np.array(
+        [
+            [1.0, crosstalk, crosstalk / 2],
+            [crosstalk / 2, 1.0, crosstalk],
+            [crosstalk, crosstalk / 2, 1.0],
+        ]
+    )
+
+    # What the receiver would measure from a printed calibration target
+    target = simulate_capture(render_calibration_target(400), mixing, noise=0, blur=0, rng=rng)
+    calibrated = ColorCalibration.from_target(target)
+
+    results = []
+    for size in payload_sizes:
+        row = {"payload_bytes": size, "mono": 0, "color_raw": 0, "color_calibrated": 0}
+        mono_time = color_time = 0.0
+        for _ in range(trials):
+            payload = base64.b64encode(rng.bytes(size))
+
+            mono = qrcode.make(payload, box_size=10, border=4).convert("RGB")
+            frame = simulate_capture(mono, mixing, rng=rng)
+            start = time.perf_counter()
+            qr_codes = decode(frame)
+            mono_time += time.perf_counter() - start
+            row["mono"] += bool(qr_codes) and qr_codes[0].data == payload
+
+            # Same module size, three times the payload
+            color_payload = base64.b64encode(rng.bytes(3 * size))
+            frame = simulate_capture(make_color_qr(color_payload), mixing, rng=rng)
+            row["color_raw"] += decode_color_qr(frame) == color_payload
+            start = time.perf_counter()
+            row["color_calibrated"] += decode_color_qr(frame, calibrated) == color_payload
+            color_time += time.perf_counter() - start
+
+        for key in ("mono", "color_raw", "color_calibrated"):
+            row[key] /= trials
+        row["mono_decode_ms"] = 1000 * mono_time / trials
+        row["color_decode_ms"] = 1000 * color_time / trials
+        results.append(row)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Colour-multiplexed QR tools")
+    parser.add_argument("--target", help="Write a printable calibration target to this path")
+    parser.add_argument("--calibrate", help="Calibrate from a photo of the printed target")
+    parser.add_argument("--benchmark", action="store_true", help="Run the synthetic crosstalk benchmark")
+    parser.add_argument("--crosstalk", type=float, default=0.25, help="Crosstalk used by the benchmark")
+    parser.add_argument("--trials", type=int, default=20, help="Codes per payload size in the benchmark")
+
+    args = parser.parse_args()
+
+    if args.target:
+        render_calibration_target().save(args.target)
+        print(f"Calibration target written to {args.target}")
+
+    if args.calibrate:
+        frame = cv2.imread(args.calibrate)
+        if frame is None:
+            raise RuntimeError(f"Could not read {args.calibrate}")
+        calibration = ColorCalibration.from_target(frame)
+        calibration.save()
+        print(f"Calibration saved to {CALIBRATION_FILE}")
+        print(calibration.mixing)
+
+    if args.benchmark:
+        print(f"{'payload':>8} {'mono':>6} {'raw':>6} {'calib':>6} {'mono ms':>8} {'color ms':>9}")
+        for row in benchmark(crosstalk=args.crosstalk, trials=args.trials):
+            print(
+                f"{row['payload_bytes']:>8} {row['mono']:>6.2f} {row['color_raw']:>6.2f} "
+                f"{row['color_calibrated']:>6.2f} {row['mono_decode_ms']:>8.1f} {row['color_decode_ms']:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
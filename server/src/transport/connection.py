@@ -0,0 +1,145 @@
+import argparse
+import queue
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from threading import Condition, Thread
+
+import cv2
+from pyzbar.pyzbar import decode
+
+sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
+from camera.async_camera_client import PrefetchingCameraClient
+from transport import color_qr
+from transport.receiver import Receiver
+from transport.sender import Sender
+from transport.settings import apply_profile
+
+
+class PayloadQueue:
+    """Payloads waiting for the Sender or Receiver, with their capture time.
+
+    A page stays in view for many frames. A payload that is already waiting
+    is not queued again, and beyond `maxlen` the oldest is dropped, so a
+    consumer back from a pause finds what was seen, once, instead of a replay
+    of every frame.
+    """
+
+    def __init__(self, maxlen):
+        self.items = deque(maxlen=maxlen)
+        self.ready = Condition()
+
+    def put(self, payload, timestamp):
+        with self.ready:
+            if any(queued == payload for queued, _ in self.items):
+                return
+            self.items.append((payload, timestamp))
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """Oldest (payload, capture timestamp); raises queue.Empty after timeout"""
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.items, timeout):
+                raise queue.Empty
+            return self.items.popleft()
+
+
+class Connection:
+    """Full-duplex endpoint running this host's Sender and Receiver together.
+
+    The Connection owns the only camera stream on the host. Every frame is
+    decoded once, and each payload goes to the Receiver (data packets) or the
+    Sender (standalone ACKs). Outgoing data packets carry the latest cumulative
+    ACK for the incoming stream, and ACKs found on incoming data packets are
+    handed straight to the Sender. The peer has to run a Connection as well,
+    since the data packet format differs from the simplex one.
+    """
+
+    # Distinct payloads kept for the Sender or Receiver while it is busy
+    BACKLOG = 32
+
+    def __init__(self, preview=True, camera_port=5000):
+        self.preview = preview
+
+        # With decoding at the source there are no frames, and so no preview
+        self.decode_at_source = Receiver.DECODE_AT_SOURCE and not Receiver.COLOR_MODE
+        self.camera_client = PrefetchingCameraClient(
+            backend="shm" if Receiver.CAMERA_SHM and not self.decode_at_source else "tcp",
+            port=camera_port,
+            mode="payloads" if self.decode_at_source else "latest",
+        )
+
+        self.data_payloads = PayloadQueue(self.BACKLOG)
+        self.ack_payloads = PayloadQueue(self.BACKLOG)
+
+        self.receiver = Receiver(duplex=True, preview=False, payloads=self.data_payloads)
+        self.sender = Sender(duplex=True, preview=False, payloads=self.ack_payloads)
+
+        self.sender.ack_source = self.receiver
+        self.receiver.ack_sink = self.sender
+
+    def is_ack(self, payload):
+        # Standalone ACKs are raw fixed-size packets, data packets are base64 text
+        return len(payload) == Sender.ACK_PACKET_SIZE
+
+    def route(self, payload, timestamp):
+        if self.is_ack(payload):
+            self.ack_payloads.put(payload, timestamp)
+        elif not Receiver.COLOR_MODE:
+            self.data_payloads.put(payload, timestamp)
+
+    def dispatch(self, frame, timestamp):
+        """Decode a frame once and route each payload by packet type"""
+        for qr in decode(frame):
+            self.route(qr.data, timestamp)
+
+        if Receiver.COLOR_MODE:
+            payload = color_qr.decode_color_qr(frame, self.receiver.color_calibration)
+            if payload is not None:
+                self.data_payloads.put(payload, timestamp)
+
+    def run(self):
+        Thread(target=self.sender.run, daemon=True).start()
+        Thread(target=self.receiver.run, daemon=True).start()
+
+        # OpenCV preview windows have to stay on the main thread
+        try:
+            while True:
+                if self.decode_at_source:
+                    for payload in self.camera_client.get_payloads():
+                        self.route(payload.data, payload.timestamp)
+                    continue
+
+                frame = self.camera_client.get_frame()
+                timestamp = time.time() - self.camera_client.frame_age()
+
+                if self.preview:
+                    cv2.imshow("Connection", frame)
+
+                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                        break
+
+                self.dispatch(frame, timestamp)
+        finally:
+            self.camera_client.close()
+            cv2.destroyAllWindows()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-duplex paper airplane connection")
+    parser.add_argument("--camera-port", type=int, default=5000, help="CameraServer port")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Simulated seconds per real second")
+    parser.add_argument("--no-preview", action="store_true", help="Do not show the camera window")
+    args = parser.parse_args()
+
+    apply_profile(Sender)
+    apply_profile(Receiver)
+    Sender.scale_timers(args.time_scale)
+    Receiver.scale_timers(args.time_scale)
+    connection = Connection(preview=not args.no_preview, camera_port=args.camera_port)
+    connection.run()
+
+
+if __name__ == "__main__":
+    main()
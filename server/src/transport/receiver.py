@@ -1,5 +1,11 @@
+import argparse
 import base64
+import json
+import queue
+import shutil
+import signal
 import sys
+import threading
 import time
 import zlib
 from pathlib import Path
@@ -9,7 +15,11 @@ import qrcode
 from pyzbar.pyzbar import decode
 
 sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
-from camera.camera_client import CameraClient
+from camera.async_camera_client import PrefetchingCameraClient
+from transport import color_qr
+from transport.journal import Journal
+from transport.print_handoff import PRINT_PORT, PRIORITY_ACK, PrintHandoff, module_matrix
+from transport.settings import EC_LEVELS, apply_profile, configure, parse_overrides
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
@@ -21,8 +31,38 @@ class Receiver:
     NUM_SEQS = 2 ** (8 * SEQ_NUM_FIELD_SIZE)
     N = NUM_SEQS - 2
     DATA_SIZE = PACKET_SIZE - CHECKSUM_SIZE - SEQ_NUM_FIELD_SIZE
-
-    def __init__(self):
+    WINDOW_FIELD_SIZE = 1
+    FLAGS_FIELD_SIZE = 1
+    FLAG_ACK = 0x01
+    ACK_EVERY = 4
+    ACK_DELAY = 120
+    DUP_ACK_THRESHOLD = 3
+    DUP_HOLDOFF = 5
+    POLL_INTERVAL = 0.1
+    RECV_WINDOW = N
+    MAX_PENDING_BYTES = 16 * 1024 * 1024
+    ERROR_CORRECTION = "L"
+    COLOR_MODE = False
+    JOURNAL = True
+    # Take QR payloads decoded by CameraServer instead of decoding frames here;
+    # there are no frames to preview then
+    DECODE_AT_SOURCE = False
+    # Read frames from the shared-memory ring of a CameraServer on this host
+    # started with --shm instead of over TCP; ignored with DECODE_AT_SOURCE
+    CAMERA_SHM = False
+    # Local port of the printer service; 0 writes PNG files for it instead
+    PRINT_PORT = PRINT_PORT
+
+    # Timers in seconds, shortened together when running against a simulated
+    # channel that runs faster than real time
+    TIMERS = ("ACK_DELAY", "DUP_HOLDOFF")
+
+    @classmethod
+    def scale_timers(cls, time_scale):
+        for name in cls.TIMERS:
+            setattr(cls, name, getattr(cls, name) / time_scale)
+
+    def __init__(self, duplex=False, preview=True, payloads=None, camera_port=5000):
         self.http_outgoing = PROJECT_ROOT / "data" / "app" / "out"
         self.http_incoming = PROJECT_ROOT / "data" / "app" / "in"
         self.printing_dir = PROJECT_ROOT / "data" / "transport" / "printing"
@@ -30,17 +70,102 @@ class Receiver:
         self.http_outgoing.mkdir(parents=True, exist_ok=True)
         self.http_incoming.mkdir(parents=True, exist_ok=True)
         self.printing_dir.mkdir(parents=True, exist_ok=True)
+        self.printer = PrintHandoff(self.printing_dir, self.PRINT_PORT)
+
+        self.incoming_file = self.http_incoming / "request_.json"
+
+        # With a payload queue (fed by a Connection) the Receiver does not open
+        # its own camera stream
+        self.payloads = payloads
+        # Colour codes are split into layers here, so they need whole frames
+        self.decode_at_source = self.DECODE_AT_SOURCE and not self.COLOR_MODE
+        self.camera_client = None
+        if payloads is None:
+            mode = "payloads" if self.decode_at_source else "latest"
+            backend = "shm" if self.CAMERA_SHM and mode == "latest" else "tcp"
+            self.camera_client = PrefetchingCameraClient(backend=backend, port=camera_port, mode=mode)
 
-        self.camera_client = CameraClient()
+        self.color_calibration = color_qr.ColorCalibration.load() if self.COLOR_MODE else None
 
         self.expected_seq_num = 0
+        self.last_ack = None
+        self.last_printed_ack = None
+
+        # ACK policy: in-order packets are acknowledged every ACK_EVERY packets
+        # or after ACK_DELAY seconds, whichever comes first. In full-duplex mode
+        # an outgoing data packet carrying the ACK resets both.
+        self.unacked = 0
+        self.ack_deadline = None
+        self.ack_lock = threading.Lock()
+
+        # Corrupt and out-of-order sightings only trigger a re-ACK every
+        # DUP_ACK_THRESHOLD times; repeats of the same page within DUP_HOLDOFF
+        # seconds are the camera seeing it again and do not count.
+        self.dup_count = 0
+        self.last_duplicate = (None, 0.0)
+        # Capture time of the payloads being handled, which the holdoffs
+        # compare rather than when we got round to them
+        self.seen_at = 0.0
+
+        self.duplex = duplex
+        self.preview = preview
+        self.ack_sink = None
+
+        self.stats = {
+            "pages_printed": 0,
+            "pages_decoded": 0,
+            "packets_delivered": 0,
+            "bytes_delivered": 0,
+            "corrupt": 0,
+            "out_of_order": 0,
+        }
+        self.last_sighting = (None, 0.0)
+
+        self.journal = None
+        if self.JOURNAL:
+            self.journal = Journal(PROJECT_ROOT / "data" / "transport" / "journal" / "receiver")
+            self.recover()
+
+    def recover(self):
+        """Restore the expected sequence number from the journal after a restart"""
+        state, records = self.journal.load()
+
+        incoming_size = None
+        if state is not None:
+            self.expected_seq_num = state["expected_seq_num"]
+            self.last_ack = state["last_ack"]
+            incoming_size = state["incoming_size"]
+
+        for record in records:
+            if record["op"] == "deliver":
+                self.last_ack = record["seq"]
+                self.expected_seq_num = (record["seq"] + 1) % self.NUM_SEQS
+                incoming_size = record["size"]
+
+        if incoming_size is None:
+            return
+
+        # Anything past the last journaled delivery was never acknowledged and
+        # will be retransmitted, so drop it to avoid writing it twice
+        if self.incoming_file.exists() and self.incoming_file.stat().st_size > incoming_size:
+            with open(self.incoming_file, "r+b") as f:
+                f.truncate(incoming_size)
+
+        print(f"resumed from journal: expecting packet {self.expected_seq_num}")
+
+    def snapshot(self):
+        return {
+            "expected_seq_num": self.expected_seq_num,
+            "last_ack": self.last_ack,
+            "incoming_size": self.incoming_file.stat().st_size if self.incoming_file.exists() else 0,
+        }
 
     def qr_print(self, packet, ack_num):
         packet = bytes(packet)
 
         qr = qrcode.QRCode(
             version=None,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            error_correction=EC_LEVELS[self.ERROR_CORRECTION],
             box_size=10,
             border=4,
         )
@@ -48,34 +173,113 @@ class Receiver:
         qr.add_data(packet)
         qr.make(fit=True)
 
-        qr_image = qr.make_image(fill_color="black", back_color="white")
+        # ACKs are cumulative, so an older ACK still waiting for the printer is
+        # redundant now; the printer drops queued ones by their supersede key.
+        # A repeat of the same ACK is the duplicate the Sender counts towards a
+        # fast retransmit, so it must not replace the one before it.
+        supersede = None
+        if ack_num != self.last_printed_ack:
+            supersede = "ack"
+            for old_ack in self.printing_dir.glob("ack_*.png"):
+                try:
+                    old_ack.unlink(missing_ok=True)
+                except OSError:
+                    pass  # Being printed right now
+        self.last_printed_ack = ack_num
+
+        self.printer.print_page(module_matrix(qr), f"ack_{ack_num}_{time.time_ns()}.png", PRIORITY_ACK, supersede)
+        self.stats["pages_printed"] += 1
+
+    def advertised_window(self):
+        """Number of packets past the last ACK that the receiver can take in"""
+        window = self.RECV_WINDOW
 
-        qr_image.save(self.printing_dir / f"ack_{ack_num}.png")
+        # Data the HTTP layer has not consumed yet
+        pending = self.incoming_file.stat().st_size if self.incoming_file.exists() else 0
+        window = min(window, (self.MAX_PENDING_BYTES - pending) // self.DATA_SIZE)
+
+        free = shutil.disk_usage(self.http_incoming).free
+        window = min(window, free // self.DATA_SIZE)
+
+        return max(0, window)
 
     def send_ack(self, ack):
         packet = bytearray()
+        window = self.advertised_window().to_bytes(self.WINDOW_FIELD_SIZE, sys.byteorder)
         ack = ack.to_bytes(1, sys.byteorder)
-        checksum = zlib.crc32(ack).to_bytes(4, sys.byteorder)
+        checksum = zlib.crc32(ack + window).to_bytes(4, sys.byteorder)
 
         packet.extend(checksum)
         packet.extend(ack)
+        packet.extend(window)
 
         self.qr_print(packet, int.from_bytes(ack, sys.byteorder))
 
+    def ack_now(self):
+        with self.ack_lock:
+            self.unacked = 0
+            self.ack_deadline = None
+
+        self.send_ack(self.last_ack)
+
+    def schedule_ack(self):
+        """Acknowledge last_ack now or later, according to the ACK policy"""
+        with self.ack_lock:
+            self.unacked += 1
+            send_now = self.unacked >= self.ACK_EVERY
+            if not send_now and self.ack_deadline is None:
+                self.ack_deadline = time.time() + self.ACK_DELAY
+
+        if send_now:
+            self.ack_now()
+            print("sent ack")
+
+    def flush_delayed_ack(self):
+        with self.ack_lock:
+            if self.ack_deadline is None or time.time() < self.ack_deadline:
+                return
+
+        print("delayed ACK timer expired, sending ACK")
+        self.ack_now()
+
+    def on_duplicate(self, seq_num, immediate=False):
+        """Re-ACK on a corrupt or out-of-order packet once the policy allows it"""
+        if self.last_ack is None:
+            return
+
+        now = self.seen_at
+        last_seq_num, last_seen = self.last_duplicate
+        self.last_duplicate = (seq_num, now)
+        if seq_num == last_seq_num and now - last_seen < self.DUP_HOLDOFF:
+            return
+
+        self.dup_count += 1
+        if immediate or self.dup_count >= self.DUP_ACK_THRESHOLD:
+            self.dup_count = 0
+            self.ack_now()
+
+    def piggyback_ack(self):
+        """Latest cumulative ACK and window for an outgoing data packet, or None"""
+        with self.ack_lock:
+            if self.last_ack is None:
+                return None
+            self.unacked = 0
+            self.ack_deadline = None
+
+        return self.last_ack, self.advertised_window()
+
     def recv_packet(self):
         print("Scanning for packet... Press 'q' to quit")
         try:
             while True:
-                frame = self.camera_client.get_frame()
-
-                cv2.imshow("Receiver", frame)
+                self.flush_delayed_ack()
 
-                if cv2.waitKey(1) & 0xFF == ord("q"):
+                payloads = self.next_payloads()
+                if payloads is None:
                     break
 
-                qr_codes = decode(frame)
-                for qr in qr_codes:
-                    packet = base64.b64decode(qr.data.decode("ascii"))
+                for payload in payloads:
+                    packet = base64.b64decode(payload.decode("ascii"))
 
                     print("packet", packet)
 
@@ -95,6 +299,9 @@ class Receiver:
                     )
                     data = content[self.SEQ_NUM_FIELD_SIZE :]
 
+                    if self.duplex:
+                        data = self.strip_piggyback_header(data)
+
                     return False, seq_num, data
 
         except Exception as e:
@@ -103,46 +310,148 @@ class Receiver:
 
         return True, None, None
 
+    def next_payloads(self):
+        """QR payloads from the next frame, or None if the user quit the preview"""
+        if self.payloads is not None:
+            try:
+                payload, self.seen_at = self.payloads.get(timeout=self.POLL_INTERVAL)
+                return [payload]
+            except queue.Empty:
+                return []
+
+        # The camera client reconnects by itself if CameraServer restarts;
+        # meanwhile we come back empty-handed so the timers keep running
+        if self.decode_at_source:
+            payloads = self.camera_client.get_payloads(timeout=self.POLL_INTERVAL)
+            if payloads is None:
+                return []
+            self.seen_at = time.time() - self.camera_client.frame_age()
+            return [payload.data for payload in payloads]
+
+        frame = self.camera_client.get_frame(timeout=self.POLL_INTERVAL)
+        if frame is None:
+            return []
+        self.seen_at = time.time() - self.camera_client.frame_age()
+
+        if self.preview:
+            cv2.imshow("Receiver", frame)
+
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                return None
+
+        return self.decode_frame(frame)
+
+    def decode_frame(self, frame):
+        if self.COLOR_MODE:
+            payload = color_qr.decode_color_qr(frame, self.color_calibration)
+            return [] if payload is None else [payload]
+
+        return [qr.data for qr in decode(frame)]
+
+    def strip_piggyback_header(self, data):
+        """Hand a piggybacked ACK to the local Sender and return the remaining data"""
+        flags = data[0]
+        ack_end = self.FLAGS_FIELD_SIZE + self.SEQ_NUM_FIELD_SIZE
+        window_end = ack_end + self.WINDOW_FIELD_SIZE
+
+        if flags & self.FLAG_ACK and self.ack_sink is not None:
+            ack = int.from_bytes(data[self.FLAGS_FIELD_SIZE : ack_end], sys.byteorder)
+            window = int.from_bytes(data[ack_end:window_end], sys.byteorder)
+            self.ack_sink.on_piggybacked_ack(ack, window, self.seen_at)
+
+        return data[window_end:]
+
     def write_to_http_incoming(self, data):
-        with open(self.http_incoming / "request_.json", "ab") as f:
+        with open(self.incoming_file, "ab") as f:
             f.write(data)
             f.flush()
 
+    def count_sighting(self, seq_num):
+        """Count a decoded page once, not once per frame it stays in view"""
+        now = self.seen_at
+        last_seq_num, last_seen = self.last_sighting
+        self.last_sighting = (seq_num, now)
+        if seq_num != last_seq_num or now - last_seen >= self.DUP_HOLDOFF:
+            self.stats["pages_decoded"] += 1
+
     def run(self):
         try:
-            last_ack = None
-
             while True:
                 corrupt, seq_num, data = self.recv_packet()
                 print("received packet")
 
                 if corrupt:
                     print("corrupt packet")
-                    if last_ack is not None:
-                        self.send_ack(last_ack)
+                    self.stats["corrupt"] += 1
+                    self.on_duplicate(None)
                     continue
 
+                self.count_sighting(seq_num)
+
                 if seq_num != self.expected_seq_num:
                     print("out of order packet")
-                    if last_ack is not None:
-                        self.send_ack(last_ack)
+                    self.stats["out_of_order"] += 1
+                    # An empty packet is a zero-window probe and wants an answer
+                    self.on_duplicate(seq_num, immediate=not data)
                     continue
 
-                self.send_ack(self.expected_seq_num)
-                print("sent ack")
-                last_ack = self.expected_seq_num
-                self.expected_seq_num = (self.expected_seq_num + 1) % self.NUM_SEQS
+                if self.advertised_window() == 0:
+                    # No room for it; the re-ACK tells the sender to stop
+                    print("receive window full, dropping packet")
+                    self.on_duplicate(seq_num, immediate=True)
+                    continue
 
+                # Deliver and journal before acknowledging, so an ACK is never
+                # printed for data a crash could still lose
                 print("i am writing!!")
                 self.write_to_http_incoming(data)
+
+                self.last_ack = self.expected_seq_num
+                self.expected_seq_num = (self.expected_seq_num + 1) % self.NUM_SEQS
+                if self.journal is not None:
+                    # The HTTP layer unlinks the file once it has parsed it
+                    size = self.incoming_file.stat().st_size if self.incoming_file.exists() else 0
+                    self.journal.append("deliver", seq=self.last_ack, size=size)
+                    self.journal.maybe_compact(self.snapshot)
+
+                self.stats["packets_delivered"] += 1
+                self.stats["bytes_delivered"] += len(data)
+                self.dup_count = 0
+                self.schedule_ack()
         finally:
-            self.camera_client.close()
-            cv2.destroyAllWindows()
+            if self.camera_client is not None:
+                self.camera_client.close()
+            if self.journal is not None:
+                self.journal.close()
+            self.printer.close()
+            # Headless OpenCV builds have no windows to destroy
+            if self.preview:
+                cv2.destroyAllWindows()
 
 
 def main():
-    recv = Receiver()
-    recv.run()
+    parser = argparse.ArgumentParser(description="Go-Back-N receiver over paper airplanes")
+    parser.add_argument("--camera-port", type=int, default=5000, help="CameraServer port")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Simulated seconds per real second")
+    parser.add_argument("--no-preview", action="store_true", help="Do not show the camera window")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="Override a Receiver setting")
+    parser.add_argument("--stats", help="Write transfer statistics as JSON to this file on exit")
+    args = parser.parse_args()
+
+    apply_profile(Receiver)
+    configure(Receiver, parse_overrides(args.set))
+    Receiver.scale_timers(args.time_scale)
+    recv = Receiver(preview=not args.no_preview, camera_port=args.camera_port)
+
+    # Benchmark runners stop us with SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        recv.run()
+    finally:
+        if args.stats:
+            with open(args.stats, "w") as f:
+                json.dump(recv.stats, f, indent=2)
 
 
 if __name__ == "__main__":
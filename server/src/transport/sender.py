@@ -1,3 +1,7 @@
+import argparse
+import json
+import queue
+import signal
 import sys
 import time
 import zlib
@@ -8,10 +12,15 @@ import base64
 
 import cv2
 import qrcode
+from qrcode.exceptions import DataOverflowError
 from pyzbar.pyzbar import decode
 
 sys.path.append(str(Path(__file__).parent.parent))  # Add src to Python path
-from camera.camera_client import CameraClient
+from camera.async_camera_client import PrefetchingCameraClient
+from transport import color_qr
+from transport.journal import Journal
+from transport.print_handoff import PRINT_PORT, PRIORITY_DATA, PRIORITY_RETRANSMISSION, PrintHandoff, module_matrix
+from transport.settings import EC_LEVELS, apply_profile, configure, parse_overrides, qr_fits
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
@@ -23,9 +32,45 @@ class Sender:
     NUM_SEQS = 2 ** (8 * SEQ_NUM_FIELD_SIZE)
     N = NUM_SEQS - 2
     DATA_SIZE = PACKET_SIZE - CHECKSUM_SIZE - SEQ_NUM_FIELD_SIZE
+    WINDOW_FIELD_SIZE = 1
+    ACK_PACKET_SIZE = CHECKSUM_SIZE + SEQ_NUM_FIELD_SIZE + WINDOW_FIELD_SIZE
+    FLAGS_FIELD_SIZE = 1
+    FLAG_ACK = 0x01
     TIMEOUT = 6000
-
-    def __init__(self):
+    PROBE_INTERVAL = 600
+    SEND_PAUSE = 300
+    # Duplicate ACKs before a fast retransmit. The Receiver re-ACKs only every
+    # Receiver.DUP_ACK_THRESHOLD out-of-order pages, so with both at 3 base is
+    # resent after about nine pages have landed past the hole.
+    DUP_ACK_THRESHOLD = 3
+    DUP_HOLDOFF = 5
+    POLL_INTERVAL = 0.1
+    ERROR_CORRECTION = "L"
+    # Error-correction level per send attempt of a packet (first send,
+    # first retransmission, ...), the last one repeating. Packets that have
+    # already timed out get sturdier codes. Never below ERROR_CORRECTION.
+    EC_POLICY = "LMQH"
+    COLOR_MODE = False
+    JOURNAL = True
+    # Take QR payloads decoded by CameraServer instead of decoding frames here;
+    # there are no frames to preview then
+    DECODE_AT_SOURCE = False
+    # Read frames from the shared-memory ring of a CameraServer on this host
+    # started with --shm instead of over TCP; ignored with DECODE_AT_SOURCE
+    CAMERA_SHM = False
+    # Local port of the printer service; 0 writes PNG files for it instead
+    PRINT_PORT = PRINT_PORT
+
+    # Timers in seconds, shortened together when running against a simulated
+    # channel that runs faster than real time
+    TIMERS = ("TIMEOUT", "PROBE_INTERVAL", "SEND_PAUSE", "DUP_HOLDOFF")
+
+    @classmethod
+    def scale_timers(cls, time_scale):
+        for name in cls.TIMERS:
+            setattr(cls, name, getattr(cls, name) / time_scale)
+
+    def __init__(self, duplex=False, preview=True, payloads=None, camera_port=5000):
         self.http_outgoing = PROJECT_ROOT / "data" / "app" / "out"
         self.http_incoming = PROJECT_ROOT / "data" / "app" / "in"
         self.printing_dir = PROJECT_ROOT / "data" / "transport" / "printing"
@@ -33,30 +78,155 @@ class Sender:
         self.http_outgoing.mkdir(parents=True, exist_ok=True)
         self.http_incoming.mkdir(parents=True, exist_ok=True)
         self.printing_dir.mkdir(parents=True, exist_ok=True)
+        self.printer = PrintHandoff(self.printing_dir, self.PRINT_PORT)
+
+        # In full-duplex mode every data packet also carries the latest
+        # cumulative ACK for the reverse stream, taken from ack_source
+        self.duplex = duplex
+        self.preview = preview
+        self.ack_source = None
+        self.piggybacked_acks = deque()
+
+        if self.duplex:
+            self.DATA_SIZE -= self.FLAGS_FIELD_SIZE + self.SEQ_NUM_FIELD_SIZE + self.WINDOW_FIELD_SIZE
+
+        if self.COLOR_MODE:
+            # Each page carries three layers, so each packet can carry three times the data
+            self.DATA_SIZE += (color_qr.NUM_LAYERS - 1) * self.PACKET_SIZE
+
+        self.ec_levels = self.usable_ec_levels()
 
         self.buffer = dict()
         self.base = 0
         self.next_seq_num = 0
+        self.peer_window = self.N
+
+        # Duplicate ACKs for base - 1 mean the packet at base went missing.
+        # Repeats of the same ACK and window within DUP_HOLDOFF seconds are the
+        # camera seeing the same page again and are not counted.
+        self.dup_ack_count = 0
+        self.last_ack_seen = (None, 0.0)
+        # Capture time of the ACK being handled, which the holdoff compares
+        # rather than when we got round to it
+        self.seen_at = 0.0
+        # Whether the receiver has ACKed anything yet; until then its ACK for
+        # base - 1 is only its initial state, not a sign of loss
+        self.acked = False
+
+        self.attempts = dict()
+        # Whether the probe timer is running for a closed receiver window
+        self.probing = False
 
         self.http_outgoing_queue = deque()
         self.processed_files = set()
 
-        self.camera_client = CameraClient()
+        self.stats = {
+            "pages_printed": 0,
+            "packets_sent": 0,
+            "retransmissions": 0,
+            "fast_retransmits": 0,
+            "probes": 0,
+            "acks": 0,
+            "duplicate_acks": 0,
+        }
+
+        # With a payload queue (fed by a Connection) the Sender does not open
+        # its own camera stream
+        self.payloads = payloads
+        self.camera_client = None
+        if payloads is None:
+            mode = "payloads" if self.DECODE_AT_SOURCE else "latest"
+            backend = "shm" if self.CAMERA_SHM and mode == "latest" else "tcp"
+            self.camera_client = PrefetchingCameraClient(backend=backend, port=camera_port, mode=mode)
 
         self.stop_timer()
 
+        self.journal = None
+        if self.JOURNAL:
+            self.journal = Journal(PROJECT_ROOT / "data" / "transport" / "journal" / "sender")
+            self.recover()
+
+    def recover(self):
+        """Rebuild the window and queue from the journal after a restart"""
+        state, records = self.journal.load()
+
+        if state is not None:
+            self.base = state["base"]
+            self.next_seq_num = state["next_seq_num"]
+            self.peer_window = state["peer_window"]
+            self.acked = state.get("acked", True)
+            self.buffer = {int(seq): base64.b64decode(data) for seq, data in state["buffer"].items()}
+            self.processed_files = {Path(path) for path in state["processed_files"]}
+            self.http_outgoing_queue = deque(base64.b64decode(chunk) for chunk in state["queue"])
+
+        for record in records:
+            if record["op"] == "file":
+                self.processed_files.add(Path(record["path"]))
+                if "chunks" in record:
+                    self.http_outgoing_queue.extend(base64.b64decode(chunk) for chunk in record["chunks"])
+                else:
+                    # Older journals only kept the path, so the file has to still be there
+                    self.enqueue_file(Path(record["path"]))
+            elif record["op"] == "send":
+                self.buffer[record["seq"]] = base64.b64decode(record["data"])
+                self.next_seq_num = (record["seq"] + 1) % self.NUM_SEQS
+                # The chunk is in the record itself, even if its file could not be re-read
+                if self.http_outgoing_queue:
+                    self.http_outgoing_queue.popleft()
+            elif record["op"] == "ack":
+                self.base = record["base"]
+                self.peer_window = record["window"]
+                self.acked = record.get("acked", True)
+
+        if state is not None or records:
+            print(f"resumed from journal: base {self.base}, next_seq_num {self.next_seq_num}")
+
+        if self.in_flight() > 0:
+            self.start_timer()
+
+    def snapshot(self):
+        return {
+            "base": self.base,
+            "next_seq_num": self.next_seq_num,
+            "peer_window": self.peer_window,
+            "acked": self.acked,
+            "buffer": {str(seq): base64.b64encode(data).decode("ascii") for seq, data in self.buffer.items()},
+            "processed_files": [str(path) for path in self.processed_files],
+            "queue": [base64.b64encode(chunk).decode("ascii") for chunk in self.http_outgoing_queue],
+        }
+
+    def log_state(self, op, **fields):
+        if self.journal is None:
+            return
+
+        self.journal.append(op, **fields)
+        self.journal.maybe_compact(self.snapshot)
+
     def read_from_http_outgoing(self):
         for file_path in self.http_outgoing.glob("response_*.json"):
             if file_path in self.processed_files:
                 continue
 
             self.processed_files.add(file_path)
-
+            chunks = self.enqueue_file(file_path)
+            # The chunks go into the journal, since the file may be gone by the
+            # time the Sender restarts
+            self.log_state(
+                "file", path=str(file_path), chunks=[base64.b64encode(chunk).decode("ascii") for chunk in chunks]
+            )
+
+    def enqueue_file(self, file_path):
+        """Queue a file's chunks for sending and return them; none if it is gone"""
+        try:
             with open(file_path, "rb") as f:
                 data = f.read()
+        except FileNotFoundError:
+            print(f"{file_path} is gone, skipping it")
+            return []
 
-            for i in range(0, len(data), self.DATA_SIZE):
-                self.http_outgoing_queue.append(data[i : i + self.DATA_SIZE])
+        chunks = [data[i : i + self.DATA_SIZE] for i in range(0, len(data), self.DATA_SIZE)]
+        self.http_outgoing_queue.extend(chunks)
+        return chunks
 
     def prepare_packet(self, data, seq_num):
         packet = bytearray()
@@ -65,6 +235,8 @@ class Sender:
 
         seq_plus_data = bytearray()
         seq_plus_data.extend(seq_num_bytes)
+        if self.duplex:
+            seq_plus_data.extend(self.piggyback_header())
         seq_plus_data.extend(data)
 
         checksum = zlib.crc32(seq_plus_data).to_bytes(4, sys.byteorder)
@@ -72,60 +244,206 @@ class Sender:
         packet.extend(checksum)
         packet.extend(seq_plus_data)
 
-        self.buffer[seq_num] = packet
-
         return packet
 
+    def piggyback_header(self):
+        """Flags, ACK number and window carried in front of the data in duplex mode"""
+        ack = self.ack_source.piggyback_ack() if self.ack_source is not None else None
+        if ack is None:
+            return bytes(self.FLAGS_FIELD_SIZE + self.SEQ_NUM_FIELD_SIZE + self.WINDOW_FIELD_SIZE)
+
+        ack_num, window = ack
+        header = bytearray()
+        header.extend(self.FLAG_ACK.to_bytes(self.FLAGS_FIELD_SIZE, sys.byteorder))
+        header.extend(ack_num.to_bytes(self.SEQ_NUM_FIELD_SIZE, sys.byteorder))
+        header.extend(window.to_bytes(self.WINDOW_FIELD_SIZE, sys.byteorder))
+
+        return header
+
+    def on_piggybacked_ack(self, ack, window, timestamp):
+        """Called by the duplex Receiver when a data packet captured at
+        timestamp carried an ACK for us"""
+        self.piggybacked_acks.append((ack, window, timestamp))
+
     def send_packet(self, seq_num):
-        packet = self.buffer[seq_num]
+        # Packets are framed at send time so retransmissions carry a fresh ACK
+        packet = self.prepare_packet(self.buffer[seq_num], seq_num)
         b64_string = base64.b64encode(packet).decode("ascii")
+        self.stats["pages_printed"] += 1
+
+        attempt = self.attempts.get(seq_num, 0)
+        self.attempts[seq_num] = attempt + 1
+
+        # Step down from the policy's level if the packet does not fit a QR
+        # code at that level; past version 40 qrcode raises ValueError
+        for ec in reversed(self.ec_levels_for(attempt)):
+            try:
+                qr_image = self.make_qr_image(b64_string, ec)
+                break
+            except (DataOverflowError, ValueError):
+                continue
+        else:
+            raise DataOverflowError(f"Packet {seq_num} does not fit in a QR code")
+
+        # Retransmissions jump the printer queue, and a newer copy of a packet
+        # replaces one still waiting there
+        priority = PRIORITY_RETRANSMISSION if attempt else PRIORITY_DATA
+        self.printer.print_page(qr_image, self.packet_filename(seq_num), priority, f"packet_{seq_num}")
+
+    def usable_ec_levels(self):
+        """Levels from ERROR_CORRECTION up that the largest packet fits at"""
+        order = list(EC_LEVELS)
+        packet_size = self.CHECKSUM_SIZE + self.SEQ_NUM_FIELD_SIZE + self.DATA_SIZE
+        if self.duplex:
+            packet_size += self.FLAGS_FIELD_SIZE + self.SEQ_NUM_FIELD_SIZE + self.WINDOW_FIELD_SIZE
+        length = 4 * -(-packet_size // 3)  # Base64
+        if self.COLOR_MODE:
+            length = -(-length // color_qr.NUM_LAYERS)
+
+        levels = [ec for ec in order[order.index(self.ERROR_CORRECTION) :] if qr_fits(length, ec)]
+        if not levels:
+            raise ValueError(f"PACKET_SIZE {self.PACKET_SIZE} does not fit a QR code at {self.ERROR_CORRECTION}")
+        if len(levels) < len(order) - order.index(self.ERROR_CORRECTION):
+            print(f"PACKET_SIZE {self.PACKET_SIZE} fits a QR code at levels {''.join(levels)} only")
+
+        return levels
+
+    def ec_levels_for(self, attempt):
+        """Levels from ERROR_CORRECTION up to the one the policy wants for this
+        attempt, or the strongest one the packets fit at"""
+        order = list(EC_LEVELS)
+        wanted = order.index(self.EC_POLICY[min(attempt, len(self.EC_POLICY) - 1)])
+
+        return [ec for ec in self.ec_levels if order.index(ec) <= wanted] or self.ec_levels[:1]
+
+    def make_qr_image(self, b64_string, ec):
+        if self.COLOR_MODE:
+            return color_qr.make_color_qr(b64_string, EC_LEVELS[ec])
 
         qr = qrcode.QRCode(
             version=None,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            error_correction=EC_LEVELS[ec],
             box_size=10,
             border=4,
         )
         qr.add_data(b64_string)
         qr.make(fit=True)
 
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        qr_image.save(self.printing_dir / f"packet_{seq_num}.png")
+        return module_matrix(qr)
+
+    def packet_filename(self, seq_num):
+        # Unique per send, since the printer skips file names it has printed before
+        return f"packet_{seq_num}_{time.time_ns()}.png"
 
     def recv_packet(self):
+        """(corrupt, ack, window, standalone) of the next ACK; standalone is
+        False for an ACK that came piggybacked on one of the peer's data pages"""
         print("Scanning for ACK code... Press 'q' to quit")
 
         while not self.is_timeout():
             try:
-                frame = self.camera_client.get_frame()
-
-                cv2.imshow("Sender", frame)
+                if self.piggybacked_acks:
+                    ack, window, self.seen_at = self.piggybacked_acks.popleft()
+                    return False, ack, window, False
 
-                if cv2.waitKey(1) & 0xFF == ord("q"):
+                payloads = self.next_payloads()
+                if payloads is None:
                     break
 
-                qr_codes = decode(frame)
-
-                for qr in qr_codes:
-                    packet = qr.data
-
+                for packet in payloads:
                     checksum_from_packet = int.from_bytes(
                         packet[: self.CHECKSUM_SIZE], sys.byteorder
                     )
 
-                    ack = packet[self.CHECKSUM_SIZE :]
+                    content = packet[self.CHECKSUM_SIZE :]
+
+                    if zlib.crc32(content) != checksum_from_packet:
+                        return True, None, None, True
 
-                    if zlib.crc32(ack) != checksum_from_packet:
-                        return True, None
+                    ack = content[: self.SEQ_NUM_FIELD_SIZE]
+                    window = content[self.SEQ_NUM_FIELD_SIZE :]
 
-                    return False, int.from_bytes(ack, sys.byteorder)
+                    return False, int.from_bytes(ack, sys.byteorder), int.from_bytes(window, sys.byteorder), True
 
             except Exception as e:
                 print(f"Error reading from camera: {e}")
-                return True, None
+                return True, None, None, True
 
         raise TimeoutError("Timeout waiting for ACK")
 
+    def next_payloads(self):
+        """QR payloads from the next frame, or None if the user quit the preview"""
+        if self.payloads is not None:
+            try:
+                payload, self.seen_at = self.payloads.get(timeout=self.POLL_INTERVAL)
+                return [payload]
+            except queue.Empty:
+                return []
+
+        # The camera client reconnects by itself if CameraServer restarts;
+        # meanwhile we come back empty-handed so the timers keep running
+        if self.DECODE_AT_SOURCE:
+            payloads = self.camera_client.get_payloads(timeout=self.POLL_INTERVAL)
+            if payloads is None:
+                return []
+            self.seen_at = time.time() - self.camera_client.frame_age()
+            return [payload.data for payload in payloads]
+
+        frame = self.camera_client.get_frame(timeout=self.POLL_INTERVAL)
+        if frame is None:
+            return []
+        self.seen_at = time.time() - self.camera_client.frame_age()
+
+        if self.preview:
+            cv2.imshow("Sender", frame)
+
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                return None
+
+        return [qr.data for qr in decode(frame)]
+
+    def send_probe(self):
+        """Zero-window probe: an empty packet the receiver will re-ACK with its window"""
+        probe_seq = (self.base - 1) % self.NUM_SEQS
+        self.buffer[probe_seq] = b""
+        self.attempts.pop(probe_seq, None)
+        self.send_packet(probe_seq)
+        self.stats["probes"] += 1
+
+    def is_repeat_sighting(self, ack, window):
+        """Whether the camera is seeing the last ACK page taken again: the same
+        ACK number and window within DUP_HOLDOFF of when it was taken"""
+        now = self.seen_at
+        last_sighting, last_seen = self.last_ack_seen
+        if (ack, window) == last_sighting and now - last_seen < self.DUP_HOLDOFF:
+            return True
+
+        self.last_ack_seen = ((ack, window), now)
+        return False
+
+    def on_duplicate_ack(self):
+        """Fast retransmit of base once DUP_ACK_THRESHOLD duplicates have arrived"""
+        if self.in_flight() == 0:
+            return
+
+        self.dup_ack_count += 1
+        self.stats["duplicate_acks"] += 1
+        if self.dup_ack_count == self.DUP_ACK_THRESHOLD:
+            print(f"{self.dup_ack_count} duplicate ACKs, fast retransmit of {self.base}")
+            self.send_packet(self.base)
+            self.stats["retransmissions"] += 1
+            self.stats["fast_retransmits"] += 1
+            self.start_timer()
+
+    def in_flight(self):
+        return (self.next_seq_num - self.base) % self.NUM_SEQS
+
+    def send_window(self):
+        return min(self.N, self.peer_window)
+
+    def start_probe_timer(self):
+        self.cutoff = time.time() + self.PROBE_INTERVAL
+
     def start_timer(self):
         self.cutoff = time.time() + self.TIMEOUT
 
@@ -141,10 +459,8 @@ class Sender:
 
             while True:
                 try:
-                    window = {
-                        i % self.NUM_SEQS for i in range(self.base, self.base + self.N)
-                    }
-                    while self.next_seq_num in window:
+                    sent = False
+                    while self.in_flight() < self.send_window():
                         print("i am reading from http outgoing")
                         self.read_from_http_outgoing()
 
@@ -156,31 +472,81 @@ class Sender:
 
                         in_data = self.http_outgoing_queue.popleft()
 
-                        self.prepare_packet(in_data, self.next_seq_num)
-                        self.send_packet(self.next_seq_num)
+                        seq_num = self.next_seq_num
+                        self.buffer[seq_num] = in_data
+                        self.attempts.pop(seq_num, None)
+                        self.next_seq_num = (seq_num + 1) % self.NUM_SEQS
+                        self.log_state("send", seq=seq_num, data=base64.b64encode(in_data).decode("ascii"))
+
+                        self.send_packet(seq_num)
+                        self.stats["packets_sent"] += 1
                         print("i am sending packet")
+                        sent = True
 
-                        if self.base == self.next_seq_num:
+                        if self.base == seq_num:
                             self.start_timer()
 
-                        self.next_seq_num = (self.next_seq_num + 1) % self.NUM_SEQS
+                    if sent:
+                        time.sleep(self.SEND_PAUSE)
+                    if self.peer_window == 0 and self.in_flight() == 0:
+                        # Nothing outstanding would make the receiver ACK again.
+                        # Armed once, so pages left in view cannot keep
+                        # pushing the probe back.
+                        if not self.probing:
+                            self.probing = True
+                            self.start_probe_timer()
+                    else:
+                        self.probing = False
 
-                    time.sleep(300)
-                    corrupt, ack = self.recv_packet()
+                    corrupt, ack, window, standalone = self.recv_packet()
 
                     if corrupt:
                         continue
 
+                    newly_acked = (ack + 1 - self.base) % self.NUM_SEQS
+                    if newly_acked > self.in_flight():
+                        print("stale ACK ignored")
+                        continue
+
+                    # A changed window always gets through, e.g. the answer
+                    # to a zero-window probe that repeats the last ACK number
+                    window_update = window != self.peer_window
+                    if self.is_repeat_sighting(ack, window) and not window_update:
+                        continue
+
+                    self.peer_window = window
+                    if newly_acked == 0:
+                        self.log_state("ack", base=self.base, window=self.peer_window, acked=self.acked)
+                        # As in TCP (RFC 5681), only a standalone ACK that moves
+                        # neither base nor the window is a duplicate; ACKs riding
+                        # on the peer's data pages repeat base - 1 all the time
+                        if standalone and not window_update and self.acked:
+                            self.on_duplicate_ack()
+                        continue
+
+                    self.dup_ack_count = 0
+                    self.stats["acks"] += 1
                     self.base = (ack + 1) % self.NUM_SEQS
+                    self.acked = True
+                    self.log_state("ack", base=self.base, window=self.peer_window, acked=self.acked)
                     if self.base == self.next_seq_num:
                         self.stop_timer()
-                        if last_iter:
+                        # Everything is ACKed; the last packet may have filled
+                        # the window before the queue was seen to be empty
+                        if last_iter or not self.http_outgoing_queue:
                             break
                     else:
                         self.start_timer()
 
                 except TimeoutError:
+                    if self.in_flight() == 0:
+                        print("receiver window is closed, sending probe")
+                        self.send_probe()
+                        self.start_probe_timer()
+                        continue
+
                     self.start_timer()
+                    self.dup_ack_count = 0
 
                     for i in range(
                         self.base,
@@ -192,14 +558,41 @@ class Sender:
                     ):
                         j = i % self.NUM_SEQS
                         self.send_packet(j)
+                        self.stats["retransmissions"] += 1
         finally:
-            self.camera_client.close()
-            cv2.destroyAllWindows()
+            if self.camera_client is not None:
+                self.camera_client.close()
+            if self.journal is not None:
+                self.journal.close()
+            self.printer.close()
+            # Headless OpenCV builds have no windows to destroy
+            if self.preview:
+                cv2.destroyAllWindows()
 
 
 def main():
-    sender = Sender()
-    sender.run()
+    parser = argparse.ArgumentParser(description="Go-Back-N sender over paper airplanes")
+    parser.add_argument("--camera-port", type=int, default=5000, help="CameraServer port")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Simulated seconds per real second")
+    parser.add_argument("--no-preview", action="store_true", help="Do not show the camera window")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="Override a Sender setting")
+    parser.add_argument("--stats", help="Write transfer statistics as JSON to this file on exit")
+    args = parser.parse_args()
+
+    apply_profile(Sender)
+    configure(Sender, parse_overrides(args.set))
+    Sender.scale_timers(args.time_scale)
+    sender = Sender(preview=not args.no_preview, camera_port=args.camera_port)
+
+    # Benchmark runners stop us with SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        sender.run()
+    finally:
+        if args.stats:
+            with open(args.stats, "w") as f:
+                json.dump(sender.stats, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""Overriding Sender and Receiver class settings by name.
+
+Settings are the upper-case class attributes (PACKET_SIZE, N, TIMEOUT, ...).
+They can be overridden from the command line with ``--set NAME=VALUE`` and
+from the tuned profile written by tuner.py, without editing the class
+definitions. Command line overrides win over the profile.
+"""
+import json
+from pathlib import Path
+
+import qrcode
+from qrcode import util
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+PROFILE_FILE = PROJECT_ROOT / "data" / "transport" / "profile.json"
+
+# Weakest to strongest
+EC_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+# The largest QR code
+MAX_QR_VERSION = 40
+
+
+def qr_fits(length, ec):
+    """Whether `length` characters fit one QR code at level ec.
+
+    Counted in byte mode, the most a base64 payload can need. qrcode raises a
+    ValueError rather than DataOverflowError for data past version 40, so
+    callers check this before encoding.
+    """
+    needed_bits = 4 + util.length_in_bits(util.MODE_8BIT_BYTE, MAX_QR_VERSION) + 8 * length
+    return needed_bits <= util.BIT_LIMIT_TABLE[EC_LEVELS[ec]][MAX_QR_VERSION]
+
+
+def parse_value(current, text):
+    """Convert text to the type of the setting's current value"""
+    if isinstance(current, bool):
+        if text.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"Expected true or false, got {text!r}")
+        return text.lower() in ("true", "1")
+    if isinstance(current, (int, float)):
+        # Timers are written as ints but may be given fractional values
+        value = float(text)
+        return int(value) if isinstance(current, int) and value.is_integer() else value
+    return type(current)(text)
+
+
+def parse_overrides(pairs):
+    """Turn ["NAME=VALUE", ...] into a dict of unconverted values"""
+    overrides = {}
+    for pair in pairs or []:
+        name, sep, value = pair.partition("=")
+        if not sep:
+            raise ValueError(f"Expected NAME=VALUE, got {pair!r}")
+        overrides[name.strip()] = value.strip()
+
+    return overrides
+
+
+# Settings computed from others, in dependency order. Each applies to the
+# classes that have it. Those marked overridable are only defaults: once set
+# directly they are kept.
+DERIVED = (
+    ("NUM_SEQS", lambda cls: 2 ** (8 * cls.SEQ_NUM_FIELD_SIZE), False),
+    ("DATA_SIZE", lambda cls: cls.PACKET_SIZE - cls.CHECKSUM_SIZE - cls.SEQ_NUM_FIELD_SIZE, False),
+    ("ACK_PACKET_SIZE", lambda cls: cls.CHECKSUM_SIZE + cls.SEQ_NUM_FIELD_SIZE + cls.WINDOW_FIELD_SIZE, False),
+    ("RECV_WINDOW", lambda cls: cls.N, True),
+)
+
+
+def derive(cls):
+    """Recompute the derived settings of a Sender or Receiver class"""
+    explicit = getattr(cls, "set_explicitly", set())
+    for name, compute, overridable in DERIVED:
+        if hasattr(cls, name) and not (overridable and name in explicit):
+            setattr(cls, name, compute(cls))
+
+
+def configure(cls, overrides):
+    """Apply setting overrides to a Sender or Receiver class.
+
+    Values may be strings (from the command line) or already typed (from a
+    JSON profile). Settings derived from others are recomputed afterwards.
+    """
+    for name, value in overrides.items():
+        if not name.isupper() or not hasattr(cls, name):
+            raise ValueError(f"{cls.__name__} has no setting {name}")
+
+        current = getattr(cls, name)
+        if isinstance(value, str) and not isinstance(current, str):
+            value = parse_value(current, value)
+        elif isinstance(current, float) and isinstance(value, int):
+            value = float(value)
+        setattr(cls, name, value)
+    cls.set_explicitly = getattr(cls, "set_explicitly", set()) | set(overrides)
+
+    if "ERROR_CORRECTION" in overrides and cls.ERROR_CORRECTION not in EC_LEVELS:
+        raise ValueError(f"ERROR_CORRECTION must be one of {', '.join(EC_LEVELS)}")
+    if "EC_POLICY" in overrides and (not cls.EC_POLICY or set(cls.EC_POLICY) - set(EC_LEVELS)):
+        raise ValueError(f"EC_POLICY must be a string of the levels {', '.join(EC_LEVELS)}")
+
+    derive(cls)
+    if cls.N > cls.NUM_SEQS - 2:
+        raise ValueError(f"N must be at most {cls.NUM_SEQS - 2}")
+
+
+def apply_profile(cls, path=PROFILE_FILE):
+    """Load the tuned profile, if there is one, into a Sender or Receiver class"""
+    path = Path(path)
+    if not path.exists():
+        return
+
+    with open(path) as f:
+        profile = json.load(f)
+
+    # A profile is shared by Sender and Receiver; each takes what applies to it
+    configure(cls, {name: value for name, value in profile.items() if hasattr(cls, name)})
+    print(f"Loaded {cls.__name__} profile from {path}")
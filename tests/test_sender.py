@@ -0,0 +1,87 @@
+"""Sender tests that run without a camera, printer or peer"""
+import os
+import queue
+import sys
+import time
+import zlib
+from pathlib import Path
+from threading import Event, Thread
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent / "client" / "src"))
+pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)  # Needs libzbar
+from transport.sender import Sender
+
+
+class RecordingPrinter:
+    def __init__(self):
+        self.pages = []
+
+    def print_page(self, image, name, priority, supersede=None):
+        self.pages.append((image, name, priority, supersede))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    monkeypatch.setattr(Sender, "JOURNAL", False)
+    sender = Sender(preview=False, payloads=queue.Queue())
+    sender.printer = RecordingPrinter()
+    return sender
+
+
+def test_full_packet_is_sent_on_every_attempt(sender):
+    # A 1024-byte packet is too big for a level H code
+    assert sender.PACKET_SIZE == 1024
+    assert sender.ec_levels == ["L", "M", "Q"]
+
+    sender.buffer[0] = os.urandom(sender.DATA_SIZE)
+    for _ in range(len(sender.EC_POLICY) + 1):
+        sender.send_packet(0)
+
+    assert len(sender.printer.pages) == len(sender.EC_POLICY) + 1
+    assert sender.ec_levels_for(len(sender.EC_POLICY)) == ["L", "M", "Q"]
+
+
+def ack_page(sender, ack, window):
+    content = ack.to_bytes(sender.SEQ_NUM_FIELD_SIZE, sys.byteorder)
+    content += window.to_bytes(sender.WINDOW_FIELD_SIZE, sys.byteorder)
+    return zlib.crc32(content).to_bytes(sender.CHECKSUM_SIZE, sys.byteorder) + content
+
+
+def test_probe_fires_while_zero_window_ack_stays_in_view(sender, monkeypatch):
+    monkeypatch.setattr(Sender, "PROBE_INTERVAL", 0.3)
+    sender.peer_window = 0
+
+    class Probed(Exception):
+        pass
+
+    def print_page(image, name, priority, supersede=None):
+        raise Probed
+
+    sender.printer.print_page = print_page
+
+    # The camera keeps seeing the zero-window ACK for a while; the probe has
+    # to go out on time regardless, not only once the page is gone
+    page = ack_page(sender, sender.NUM_SEQS - 1, 0)
+    in_view = Event()
+    in_view.set()
+
+    def camera():
+        deadline = time.time() + 2
+        while time.time() < deadline and in_view.is_set():
+            sender.payloads.put((page, time.time()))
+            time.sleep(0.02)
+
+    Thread(target=camera, daemon=True).start()
+    start = time.time()
+    try:
+        with pytest.raises(Probed):
+            sender.run()
+    finally:
+        in_view.clear()
+
+    assert time.time() - start < 1